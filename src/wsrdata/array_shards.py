@@ -0,0 +1,184 @@
+"""
+Shard files that pack the array files of many scans, e.g. all scans of a station-day, into one file.
+
+A shard is an append-only concatenation of blobs, each the complete bytes of one scan's array file as written
+by wsrdata.array_store, next to an index file "<shard>.index" with one line "<crc> <key> <offset> <length>" per
+blob, where crc is the CRC32 of "<key> <offset> <length>" in hex. A blob is written before its index line,
+under an exclusive flock of the shard, so concurrent renderers (threads or processes) can append to the same
+shard, and readers never see a partially written blob: a crash leaves at most an unindexed blob or a truncated
+last index line. Lines whose crc does not match, e.g. one cut short in its length, are ignored. Lines
+"<key> <offset> <length>" of indexes written before lines had a crc are read if their blob is within the shard.
+Rewriting a key appends a new blob whose index line supersedes the previous one.
+
+Scans in shards are addressed by array paths "<shard>#<key>", e.g. "2013/07/21/KOKX.shard#KOKX20130721_093320_V06".
+Indexes are cached per process and only their new lines are parsed when a shard grows, so looking up a key
+is a dict access plus one read of the blob.
+"""
+
+import fcntl
+import io
+import os
+import threading
+import zlib
+
+
+SEPARATOR = "#"
+INDEX_SUFFIX = ".index"
+
+_index_lock = threading.Lock()
+_indexes = {} # shard path -> (bytes of the index file parsed, {key: (offset, length)})
+
+
+def is_shard_path(array_path):
+    return SEPARATOR in os.path.basename(array_path)
+
+
+def split_shard_path(array_path):
+    """(shard path, key) of an array path "<shard>#<key>" """
+    shard, key = array_path.rsplit(SEPARATOR, 1)
+    return shard, key
+
+
+def read_index(shard):
+    """Dict from keys to (offset, length) of their latest blob, {} if the shard does not exist"""
+    index_path = shard + INDEX_SUFFIX
+    try:
+        shard_size = os.path.getsize(shard)
+        with open(index_path, "rb") as f:
+            with _index_lock:
+                parsed, index = _indexes.get(shard, (0, {}))
+            if os.fstat(f.fileno()).st_size < parsed: # the shard was replaced
+                parsed, index = 0, {}
+            f.seek(parsed)
+            lines = f.read().split(b"\n")
+    except FileNotFoundError:
+        return {}
+
+    index = dict(index)
+    for line in lines[:-1]: # the last item is empty, or a line being written
+        parsed += len(line) + 1
+        entry = _parse_index_line(line, shard_size)
+        if entry is not None:
+            index[entry[0]] = entry[1:]
+    with _index_lock:
+        _indexes[shard] = (parsed, index)
+    return index
+
+
+def _index_line(key, offset, length):
+    entry = b"%s %d %d" % (key.encode(), offset, length)
+    return b"%08x %s\n" % (zlib.crc32(entry), entry)
+
+
+def _parse_index_line(line, shard_size):
+    # (key, offset, length) of an index line, or None if it is torn or corrupt
+    fields = line.split(b" ")
+    try:
+        if len(fields) == 4 and int(fields[0], 16) == zlib.crc32(b" ".join(fields[1:])):
+            return fields[1].decode(), int(fields[2]), int(fields[3])
+        if len(fields) == 3 and int(fields[1]) + int(fields[2]) <= shard_size: # written without a crc
+            return fields[0].decode(), int(fields[1]), int(fields[2])
+    except ValueError:
+        pass
+    return None
+
+
+def contains(array_path):
+    shard, key = split_shard_path(array_path)
+    return key in read_index(shard)
+
+
+def read_blob(array_path):
+    """Bytes of the latest blob of a key; KeyError if the shard does not have it"""
+    shard, key = split_shard_path(array_path)
+    index = read_index(shard)
+    if key not in index:
+        raise KeyError("%s is not in shard %s" % (key, shard))
+    offset, length = index[key]
+    with open(shard, "rb") as f:
+        f.seek(offset)
+        blob = f.read(length)
+    if len(blob) != length:
+        raise IOError("shard %s is truncated at %s" % (shard, key))
+    return blob
+
+
+class BlobReader(io.RawIOBase):
+    """Read-only file object over the bytes of one blob of a shard, so that a blob is read like a file
+    and only the parts that are accessed are read from disk
+
+    Attributes:
+        path (string): shard path
+        offset (int): offset of the blob in the shard
+        length (int): length of the blob
+    """
+
+    def __init__(self, path, offset, length):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self._file = open(path, "rb")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self.length
+        self._position = max(0, position)
+        return self._position
+
+    def readinto(self, buffer):
+        n = max(0, min(len(buffer), self.length - self._position))
+        if n == 0:
+            return 0
+        self._file.seek(self.offset + self._position)
+        n = self._file.readinto(memoryview(buffer)[:n])
+        self._position += n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_blob(array_path):
+    """BlobReader of the latest blob of a key; KeyError if the shard does not have it"""
+    shard, key = split_shard_path(array_path)
+    index = read_index(shard)
+    if key not in index:
+        raise KeyError("%s is not in shard %s" % (key, shard))
+    offset, length = index[key]
+    return BlobReader(shard, offset, length)
+
+
+def append_blob(array_path, blob):
+    """Append the blob of a key to its shard, creating the shard if needed"""
+    shard, key = split_shard_path(array_path)
+    if " " in key or "\n" in key:
+        raise ValueError("shard keys cannot contain whitespace: %r" % key)
+    with open(shard, "ab") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(blob)
+            f.flush()
+            with open(shard + INDEX_SUFFIX, "a+b") as index:
+                line = _index_line(key, offset, len(blob))
+                if index.seek(0, os.SEEK_END) > 0:
+                    index.seek(-1, os.SEEK_END)
+                    if index.read(1) != b"\n": # end a line left truncated by a crashed writer
+                        line = b"\n" + line
+                index.write(line)
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
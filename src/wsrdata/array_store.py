@@ -0,0 +1,482 @@
+"""
+Reading and writing the npz files of rendered arrays with selectable codecs.
+
+A file is always a zip archive of members. Codecs:
+    "npz"                   np.savez_compressed, i.e. zlib deflate at its default level (the default)
+    "npy"                   uncompressed npy members (zip stored), fastest to read and write, largest
+    "deflate-N"             deflate at level N from 1 (fastest) to 9 (smallest)
+    "shuffle-deflate[-N]"   numeric arrays are byte-shuffled before deflate, i.e. the first bytes of all
+                            elements are stored first, then the second bytes, etc. Exponent and high mantissa
+                            bytes of float32 radar fields vary slowly, so they compress much better once grouped.
+    "quant8[-N]"            lossy: float arrays are stored as 8 bit codes with a fixed scale and offset per
+    "quant16[-N]"           field, like Level-II data, plus a bit-packed NaN mask, then deflated at level N
+                            (default the zlib default; 0 stores them uncompressed). See QUANT_TABLES.
+
+Files written with a codec other than "npz" record it as json in the zip comment, which append_arrays reads to
+add members with the same codec; files written before recorded it in a CODEC_MEMBER json member, still read.
+The comment leaves the members untouched, so np.load reads "npz", "npy" and "deflate-N" files as before.
+It does not decode the other codecs: shuffled and quantized members are named "<name>.shuffle" and
+"<name>.quant" and start with SHUFFLE_MAGIC and QUANT_MAGIC, so np.load returns them as raw bytes rather than
+as wrong arrays. Use load_arrays to read any codec.
+
+An array may be stored with a pyramid of downsampled levels as members "<name>@<dim>", e.g. "array@300" and
+"array@150" next to a 600 x 600 "array"; load_level reads the smallest level at least as large as requested.
+
+Every function taking a path also takes the array path "<shard>#<key>" of a scan in a shard file
+(see wsrdata.array_shards), where the array file of the scan is stored as one blob.
+
+Files are written to a temporary file next to them and renamed into place, so a crash never leaves a partially
+written file behind a valid name, only possibly a "<name>.<random>.tmp" file.
+"""
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import struct
+import uuid
+import zipfile
+import numpy as np
+from wsrdata import array_shards
+
+
+DEFAULT_CODEC = "npz"
+PYRAMID_SEPARATOR = "@"
+CODEC_MEMBER = "__codec__.json" # of files written before the codec was recorded in the zip comment
+SHUFFLE_MAGIC = b"\x00SHUFFLE"
+QUANT_MAGIC = b"\x00QUANT\x00\x00"
+
+# (scale, offset) of 8 bit codes per field, i.e. a value is offset + scale * code, as in Level-II data.
+# 16 bit codes span the same range with scale / 256. Values beyond the range are clipped to it; within it,
+# the max error is scale / 2 (plus float32 rounding), i.e. with 8 | 16 bits:
+#   reflectivity                -32 to 95.5 dBZ         0.25 dBZ | 0.001 dBZ
+#   velocity                    -64 to 63.5 m/s         0.25 m/s | 0.001 m/s
+#   spectrum_width              -64 to 63.5 m/s         0.25 m/s | 0.001 m/s
+#   differential_reflectivity   -8 to 7.94 dB           0.031 dB | 0.00012 dB
+#   cross_correlation_ratio     0.2017 to 1.0517        0.0017 | 0.0000065
+#   differential_phase          0 to 358.6 degrees      0.70 degrees | 0.0027 degrees
+# Other fields are quantized over the range of their values in each array, recorded with the codes,
+# so their max error is (max - min) / 2 / 255 or / 65535.
+QUANT_TABLES = {
+    "reflectivity":                 (0.5, -32.0),
+    "velocity":                     (0.5, -64.0),
+    "spectrum_width":               (0.5, -64.0),
+    "differential_reflectivity":    (1. / 16., -8.0),
+    "cross_correlation_ratio":      (1. / 300., 60.5 / 300.),
+    "differential_phase":           (360. / 256., 0.0),
+}
+
+
+def parse_codec(codec):
+    """Parse a codec name
+
+    Returns:
+        (transform, compression, compresslevel) where transform is None, "shuffle", "quant8" or "quant16",
+        compression is a zipfile constant and compresslevel is None for the zlib default
+    """
+    if codec == "npz":
+        return None, zipfile.ZIP_DEFLATED, None
+    if codec == "npy":
+        return None, zipfile.ZIP_STORED, None
+    for quant in ("quant8", "quant16"):
+        if codec == quant:
+            return quant, zipfile.ZIP_DEFLATED, None
+        if codec.startswith(quant + "-") and codec[len(quant) + 1:].isdigit():
+            level = int(codec[len(quant) + 1:])
+            if level == 0:
+                return quant, zipfile.ZIP_STORED, None
+            if level <= 9:
+                return quant, zipfile.ZIP_DEFLATED, level
+    shuffle = codec.startswith("shuffle-")
+    name = codec[len("shuffle-"):] if shuffle else codec
+    if name == "deflate" and shuffle:
+        return "shuffle", zipfile.ZIP_DEFLATED, None
+    if name.startswith("deflate-") and name[len("deflate-"):].isdigit():
+        level = int(name[len("deflate-"):])
+        if 0 <= level <= 9:
+            return ("shuffle" if shuffle else None), zipfile.ZIP_DEFLATED, level
+    raise ValueError("unknown array codec %s" % codec)
+
+
+def _shufflable(array):
+    return array.dtype.kind in "fiuc" and array.dtype.itemsize > 1 and array.size > 0
+
+
+def shuffle_bytes(array):
+    """Bytes of a numeric array with the k-th bytes of all elements grouped together, for each k"""
+    array = np.ascontiguousarray(array)
+    return array.view(np.uint8).reshape(array.size, array.dtype.itemsize).T.tobytes()
+
+
+def unshuffle_bytes(buffer, shape, dtype):
+    """Inverse of shuffle_bytes"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    planes = np.frombuffer(buffer, dtype=np.uint8).reshape(dtype.itemsize, size)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+def quantization(field, values, bits):
+    """(scale, offset) of a field channel: from QUANT_TABLES, or spanning the finite values otherwise"""
+    if field in QUANT_TABLES:
+        scale, offset = QUANT_TABLES[field]
+        return scale * 256. / 2 ** bits, offset
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return 1.0, 0.0
+    low, high = float(finite.min()), float(finite.max())
+    return ((high - low) / (2 ** bits - 1) if high > low else 1.0), low
+
+
+def quantize(array, fields, bits):
+    """Codes, NaN mask and per-channel (scale, offset) of a float array whose first axis is fields
+
+    Args:
+        array (np.ndarray): float array, e.g. fields x elevs x dim x dim
+        fields (list of strings): field name of each channel along the first axis, or None if unknown
+        bits (int): 8 or 16
+    """
+    dtype = np.uint8 if bits == 8 else np.uint16
+    if fields is None or array.ndim == 0 or len(fields) != array.shape[0]:
+        fields = [None] * (array.shape[0] if array.ndim > 0 else 1)
+    channels = array.reshape(len(fields), -1)
+    mask = np.isnan(channels)
+    codes = np.empty(channels.shape, dtype=dtype)
+    scales, offsets = [], []
+    for i, field in enumerate(fields):
+        scale, offset = quantization(field, channels[i], bits)
+        code = np.rint((np.nan_to_num(channels[i], nan=offset) - offset) / scale)
+        codes[i] = np.clip(code, 0, 2 ** bits - 1)
+        codes[i][mask[i]] = 0
+        scales.append(scale)
+        offsets.append(offset)
+    return codes.reshape(array.shape), mask.reshape(array.shape), scales, offsets
+
+
+def dequantize(codes, mask, scales, offsets, dtype):
+    """Inverse of quantize, up to the quantization error"""
+    channels = codes.reshape(len(scales), -1)
+    array = np.empty(channels.shape, dtype=dtype)
+    for i, (scale, offset) in enumerate(zip(scales, offsets)):
+        np.multiply(channels[i], scale, out=array[i], casting="unsafe")
+        array[i] += offset
+    array = array.reshape(codes.shape)
+    if mask is not None:
+        array[mask] = np.nan
+    return array
+
+
+def _write_quantized(f, array, fields, bits):
+    codes, mask, scales, offsets = quantize(array, fields, bits)
+    has_mask = bool(mask.any())
+    header = json.dumps({"shape": list(array.shape), "dtype": array.dtype.str, "bits": bits,
+                         "scales": scales, "offsets": offsets, "mask": has_mask}).encode()
+    f.write(QUANT_MAGIC)
+    f.write(struct.pack("<I", len(header)))
+    f.write(header)
+    f.write(np.ascontiguousarray(codes).astype(codes.dtype.newbyteorder("<"), copy=False).tobytes())
+    if has_mask:
+        f.write(np.packbits(mask, axis=None).tobytes())
+
+
+def _read_quantized_header(f):
+    if f.read(len(QUANT_MAGIC)) != QUANT_MAGIC:
+        raise ValueError("not a quantized array member")
+    length, = struct.unpack("<I", f.read(4))
+    return json.loads(f.read(length))
+
+
+def _read_quantized(f):
+    header = _read_quantized_header(f)
+    shape = tuple(header["shape"])
+    size = int(np.prod(shape))
+    code_dtype = np.dtype("<u1" if header["bits"] == 8 else "<u2")
+    codes = np.frombuffer(f.read(size * code_dtype.itemsize), dtype=code_dtype).reshape(shape)
+    mask = None
+    if header["mask"]:
+        mask = np.unpackbits(np.frombuffer(f.read((size + 7) // 8), dtype=np.uint8), count=size).reshape(shape)
+        mask = mask.view(bool)
+    return dequantize(codes, mask, header["scales"], header["offsets"], np.dtype(header["dtype"]))
+
+
+def _write_member(zf, name, array, transform, fields=None):
+    array = np.asanyarray(array)
+    if transform in ("quant8", "quant16") and array.dtype.kind == "f" and array.size > 0:
+        with zf.open(name + ".quant", mode="w", force_zip64=True) as f:
+            _write_quantized(f, array, fields, 8 if transform == "quant8" else 16)
+    elif transform == "shuffle" and _shufflable(array):
+        array = np.ascontiguousarray(array)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+        with zf.open(name + ".shuffle", mode="w", force_zip64=True) as f:
+            f.write(SHUFFLE_MAGIC)
+            f.write(header.getvalue())
+            f.write(shuffle_bytes(array))
+    else:
+        with zf.open(name + ".npy", mode="w", force_zip64=True) as f:
+            np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def _source(path):
+    # what zipfile reads for a path: the path (or file object), or the blob of a scan in a shard
+    if isinstance(path, str) and array_shards.is_shard_path(path):
+        return array_shards.open_blob(path)
+    return path
+
+
+@contextlib.contextmanager
+def _open_zip(path):
+    source = _source(path)
+    try:
+        with zipfile.ZipFile(source) as zf:
+            yield zf
+    finally:
+        if source is not path:
+            source.close()
+
+
+def _mmap_location(path):
+    # (file, offset of the zip archive in it) of a path, None for file objects
+    if not isinstance(path, str):
+        return None
+    if array_shards.is_shard_path(path):
+        shard, key = array_shards.split_shard_path(path)
+        return shard, array_shards.read_index(shard)[key][0]
+    return path, 0
+
+
+def _memmap_member(location, zf, info):
+    # read-only np.memmap of an uncompressed npy member, None if it cannot be mapped
+    if location is None or info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with zf.open(info) as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        header_length = f.tell()
+    if dtype.hasobject or len(shape) == 0 or int(np.prod(shape)) == 0:
+        return None
+    zf.fp.seek(info.header_offset)
+    local_header = zf.fp.read(30)
+    name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+    file, base = location
+    offset = base + info.header_offset + len(local_header) + name_length + extra_length + header_length
+    return np.memmap(file, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+def array_exists(path):
+    """Whether a file, or a scan in a shard, exists"""
+    if array_shards.is_shard_path(path):
+        return array_shards.contains(path)
+    return os.path.exists(path)
+
+
+@contextlib.contextmanager
+def _atomic_path(path):
+    # a temporary path next to path, renamed to path if the block completes and removed otherwise
+    tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex[:16])
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def stored_size(path):
+    """Bytes of a file, or of the blob of a scan in a shard"""
+    if array_shards.is_shard_path(path):
+        shard, key = array_shards.split_shard_path(path)
+        return array_shards.read_index(shard)[key][1]
+    return os.path.getsize(path)
+
+
+def save_arrays(path, arrays, codec=DEFAULT_CODEC, fields=None):
+    """Write arrays to path as named members, replacing the file if it exists
+
+    Args:
+        path (string): output file, conventionally .npz, or array path of a scan in a shard
+        arrays (dict): from member names to arrays
+        codec (string): see the module docstring
+        fields (dict): from member names to the field name of each channel along their first axis,
+            used by the quantized codecs to look up QUANT_TABLES
+    """
+    transform, compression, level = parse_codec(codec)
+    fields = fields or {}
+
+    def write(target):
+        with zipfile.ZipFile(target, mode="w", compression=compression, compresslevel=level,
+                             allowZip64=True) as zf:
+            for name, array in arrays.items():
+                _write_member(zf, name, array, transform, fields.get(name))
+            if codec != DEFAULT_CODEC:
+                zf.comment = json.dumps({"codec": codec}).encode()
+
+    if array_shards.is_shard_path(path):
+        blob = io.BytesIO()
+        write(blob)
+        array_shards.append_blob(path, blob.getvalue())
+    else:
+        with _atomic_path(path) as tmp_path:
+            write(tmp_path)
+
+
+def read_codec(path):
+    """The codec a file (or file object) was written with"""
+    with _open_zip(path) as zf:
+        if zf.comment:
+            return json.loads(zf.comment)["codec"]
+        if CODEC_MEMBER in zf.namelist():
+            return json.loads(zf.read(CODEC_MEMBER))["codec"]
+    return DEFAULT_CODEC
+
+
+def append_arrays(path, arrays, fields=None):
+    """Add members to an existing file with its codec, without decompressing or recompressing the others
+
+    A file is copied byte for byte to a temporary file that is extended and renamed into place;
+    the blob of a scan in a shard is extended likewise and appended to the shard as its new blob.
+    """
+    fields = fields or {}
+
+    def append(target):
+        transform, compression, level = parse_codec(read_codec(target))
+        with zipfile.ZipFile(target, mode="a", compression=compression, compresslevel=level,
+                             allowZip64=True) as zf:
+            for name, array in arrays.items():
+                _write_member(zf, name, array, transform, fields.get(name))
+
+    if array_shards.is_shard_path(path):
+        blob = io.BytesIO(array_shards.read_blob(path))
+        append(blob)
+        array_shards.append_blob(path, blob.getvalue())
+    else:
+        with _atomic_path(path) as tmp_path:
+            shutil.copyfile(path, tmp_path)
+            append(tmp_path)
+
+
+MEMBER_EXTENSIONS = {".npy": None, ".shuffle": "shuffle", ".quant": "quant"}
+
+
+def _member_names(zf):
+    # member name -> (zip entry, transform)
+    members = {}
+    for info in zf.infolist():
+        for extension, transform in MEMBER_EXTENSIONS.items():
+            if info.filename.endswith(extension):
+                members[info.filename[:-len(extension)]] = (info, transform)
+    return members
+
+
+def _read_header(f, transform):
+    # returns (shape, dtype) and leaves f at the start of the data of npy and shuffled members
+    if transform == "quant":
+        header = _read_quantized_header(f)
+        return tuple(header["shape"]), np.dtype(header["dtype"])
+    if transform == "shuffle" and f.read(len(SHUFFLE_MAGIC)) != SHUFFLE_MAGIC:
+        raise ValueError("not a shuffled array member")
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def list_arrays(path):
+    """Names of the array members of a file"""
+    with _open_zip(path) as zf:
+        return list(_member_names(zf))
+
+
+def read_headers(path):
+    """Shape and dtype of each array member of a file, decompressing only the member headers
+
+    Returns:
+        dict from member names to (shape, dtype)
+    """
+    headers = {}
+    with _open_zip(path) as zf:
+        for name, (info, transform) in _member_names(zf).items():
+            with zf.open(info) as f:
+                headers[name] = _read_header(f, transform)
+    return headers
+
+
+def truncated_members(path):
+    """Members of a file whose data does not fit between their local header and the next member, or the
+    central directory, reading only the zip directory and local headers; a file cut short usually also loses
+    its central directory, which zipfile reports as zipfile.BadZipFile"""
+    truncated = []
+    with _open_zip(path) as zf:
+        infos = sorted(zf.infolist(), key=lambda info: info.header_offset)
+        ends = [info.header_offset for info in infos[1:]] + [zf.start_dir]
+        for info, end in zip(infos, ends):
+            zf.fp.seek(info.header_offset)
+            header = zf.fp.read(zipfile.sizeFileHeader)
+            if len(header) < zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+                truncated.append(info.filename)
+                continue
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            data_end = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length + info.compress_size
+            if data_end > end:
+                truncated.append(info.filename)
+    return truncated
+
+
+def load_arrays(path, names=None, mmap=False):
+    """Read array members of a file written with any codec
+
+    Args:
+        path (string): file written by save_arrays or np.savez(_compressed)
+        names (list of strings): members to read, default all; a missing name raises KeyError
+        mmap (bool): return uncompressed members, i.e. those written with the "npy" codec, as read-only
+            np.memmap views, so that e.g. reading one (field, elevation) plane of an array only reads that
+            plane from disk; other members are read into memory as usual
+
+    Returns:
+        dict from member names to arrays; quantized members are decoded to their original dtype
+    """
+    arrays = {}
+    location = _mmap_location(path) if mmap else None
+    with _open_zip(path) as zf:
+        members = _member_names(zf)
+        for name in (members if names is None else names):
+            if name not in members:
+                raise KeyError("%s is not an array in %s" % (name, path))
+            info, transform = members[name]
+            if transform is None and location is not None:
+                arrays[name] = _memmap_member(location, zf, info)
+                if arrays[name] is not None:
+                    continue
+            with zf.open(info) as f:
+                if transform == "quant":
+                    arrays[name] = _read_quantized(f)
+                elif transform == "shuffle":
+                    shape, dtype = _read_header(f, transform)
+                    arrays[name] = unshuffle_bytes(f.read(), shape, dtype)
+                else:
+                    arrays[name] = np.lib.format.read_array(f, allow_pickle=False)
+    return arrays
+
+
+def pyramid_member(name, dim):
+    """Name of the level of an array member downsampled to dim x dim pixels, e.g. "array@300" """
+    return "%s%s%d" % (name, PYRAMID_SEPARATOR, dim)
+
+
+def load_level(path, name, dim=None, mmap=False):
+    """Read the smallest level of an array member with at least dim pixels on a side, or the member itself
+    if it has no such level; dim=None reads the member itself. See load_arrays for mmap."""
+    levels = {}
+    if dim is not None:
+        prefix = name + PYRAMID_SEPARATOR
+        for member in list_arrays(path):
+            if member.startswith(prefix) and member[len(prefix):].isdigit() and int(member[len(prefix):]) >= dim:
+                levels[int(member[len(prefix):])] = member
+    member = levels[min(levels)] if levels else name
+    return load_arrays(path, [member], mmap)[member]
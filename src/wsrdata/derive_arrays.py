@@ -0,0 +1,136 @@
+"""
+Deriving the arrays of a new ARRAY_VERSION from those of an existing version, without rendering scans again.
+
+A target render config can be derived from a source config that renders the same way (coords, r_min, r_res,
+az_res, sweeps, use_ground_range, interp_method and ydirection are equal), when its fields and elevations are
+subsets of the source's, and its Cartesian grid is a crop of the source grid, possibly at a stride (a smaller
+r_max or dim), with every target pixel center on a source pixel center. Pixels are the nearest polar bins of
+their centers, so such a derivation is exact: it equals rendering the target config. A grid whose pixels are
+instead the centers of block x block source pixels can be derived approximately by pooling the blocks ("mean"
+or "max" of their valid pixels) if pooling is allowed.
+
+Grids are rarely aligned like this: x = y = np.linspace(-r_max, r_max, dim) spaces pixels 2 * r_max / (dim - 1)
+apart, so e.g. the 600 px grid of 150 km of v0.2.0 and grids of 300 or 150 px, or of r_max 75 km, are not.
+Such grids can be derived approximately if allowed, with the largest offset between the center of a target
+pixel and the center of the source pixels it is derived from recorded in the plan as "offset", in source pixels:
+    "nearest"       each target pixel takes the source pixel nearest its center, at most half a source pixel
+                    away along each axis; used for finer grids, or if pooling is not allowed
+    "mean", "max"   each target pixel pools the run of source pixels nearest it along each axis, whose mean
+                    center is at most half a source pixel away, except at the edge of the source grid where
+                    runs are cut short, e.g. 1 source pixel for 150 px from the 600 px grid of v0.2.0
+Pixels of a derived grid farther than its r_max are NaN, as when rendering.
+
+Versions are recorded in static/arrays/previous_versions.json as {"array": config, "dualpol": config}; their
+members in npz files are DERIVED_MEMBERS.
+"""
+
+import json
+import os
+import numpy as np
+from wsrdata import array_shards
+from wsrdata.array_store import save_arrays, load_arrays, list_arrays, read_codec
+from wsrdata.render_engine import cartesian_grid
+from wsrdata.utils.array_utils import block_pool, grid_offset, nearest_pixels, pixel_runs, run_pool
+
+
+GEOMETRY_KEYS = ("ydirection", "coords", "r_min", "r_res", "az_res", "sweeps", "use_ground_range", "interp_method")
+DERIVED_MEMBERS = {"array": "array", "dualpol": "dualpol_array"} # version config -> npz member
+
+
+def derivation(source, target, pool=None, approximate=False):
+    """How to derive arrays of a target render config from arrays of a source render config
+
+    Args:
+        source (dict): render config of the source arrays
+        target (dict): render config of the derived arrays
+        pool (string): None to only derive exactly, or "mean" or "max" to also allow pooling blocks of pixels
+        approximate (bool): whether to allow grids that are not aligned with the source grid, by "nearest"
+            source pixels or by pooling runs of source pixels with pool
+
+    Returns:
+        dict with the "fields" and "elevs" indices of the target in the source, the "method" ("stride", "mean",
+        "max" or "nearest"), the "offset" in source pixels (see above), and the "start" pixel and "block" of
+        aligned grids, the "bounds" of the runs of pooled grids that are not aligned, or the source pixel
+        "indices" of nearest ones; or None if the target cannot be derived
+    """
+    if any(source.get(key) != target.get(key) for key in GEOMETRY_KEYS) or source.get("coords") != "cartesian":
+        return None
+    if not set(target["fields"]) <= set(source["fields"]) or not set(target["elevs"]) <= set(source["elevs"]):
+        return None
+    if target["r_max"] > source["r_max"] or target["dim"] < 2 or source["dim"] < 2:
+        return None
+
+    plan = {"fields": [source["fields"].index(f) for f in target["fields"]],
+            "elevs": [source["elevs"].index(e) for e in target["elevs"]]}
+    grids = (source["r_max"], source["dim"], target["r_max"], target["dim"])
+    spacing = 2. * source["r_max"] / (source["dim"] - 1)
+    block = int(round(2. * target["r_max"] / (target["dim"] - 1) / spacing))
+    if block >= 1:
+        strided, pooled = grid_offset(*grids, block)
+        if strided is not None:
+            return dict(plan, start=strided, block=block, method="stride", offset=0.)
+        if pooled is not None and pool is not None and block > 1:
+            return dict(plan, start=pooled, block=block, method=pool, offset=0.)
+    if not approximate:
+        return None
+    if pool is not None:
+        bounds, offset = pixel_runs(*grids)
+        if bounds is not None:
+            return dict(plan, bounds=bounds.tolist(), method=pool, offset=round(offset, 3))
+    indices, offset = nearest_pixels(*grids)
+    return dict(plan, indices=indices.tolist(), method="nearest", offset=round(offset, 3))
+
+
+def derive_array(array, plan, target):
+    """Array of a target render config from an array of a source config, following derivation(source, target)"""
+    array = np.asarray(array)[plan["fields"]][:, plan["elevs"]]
+    if plan["method"] == "nearest":
+        array = array[..., plan["indices"], :][..., plan["indices"]]
+    elif "bounds" in plan:
+        array = run_pool(array, plan["bounds"], plan["method"])
+    elif plan["method"] == "stride":
+        start, block = plan["start"], plan["block"]
+        end = start + (target["dim"] - 1) * block + 1
+        array = array[..., start:end:block, start:end:block]
+    else:
+        start, block = plan["start"], plan["block"]
+        end = start + target["dim"] * block
+        array = block_pool(array[..., start:end, start:end], block, plan["method"])
+    outside = cartesian_grid(target)[0] == -1 # beyond r_max
+    return np.where(outside, np.float32(np.nan), array).astype(array.dtype, copy=False)
+
+
+def find_source_version(previous_versions, target_configs, pool=None, approximate=False):
+    """(version, plans) of the first recorded version from which every config of target_configs can be derived,
+    preferring exact derivations, then aligned pooling, then grids that are not aligned, or (None, None)"""
+    allowed = [(None, False)] + ([(pool, False)] if pool else []) + ([(pool, True)] if approximate else [])
+    for allow, allow_approximate in allowed:
+        for version, configs in previous_versions.items():
+            plans = {name: derivation(configs[name], config, allow, allow_approximate)
+                     for name, config in target_configs.items() if name in configs}
+            if len(plans) == len(target_configs) and all(plan is not None for plan in plans.values()):
+                return version, plans
+    return None, None
+
+
+def derive_file(source_path, target_path, plans, target_configs, array_codec=None):
+    """Derive the members of one npz file, or of one scan in a shard, with the codec of the source file
+    by default; returns the names of members derived. A member missing from the source, e.g. of a scan that
+    failed dualpol rendering, is missing from the target."""
+    available = list_arrays(source_path)
+    arrays = load_arrays(source_path, [DERIVED_MEMBERS[name] for name in plans
+                                       if DERIVED_MEMBERS[name] in available], mmap=True)
+    derived, fields = {}, {}
+    for name, plan in plans.items():
+        member = DERIVED_MEMBERS[name]
+        if member in arrays:
+            derived[member] = derive_array(arrays[member], plan, target_configs[name])
+            derived[member + ".config"] = np.array(json.dumps(target_configs[name], sort_keys=True))
+            fields[member] = target_configs[name]["fields"]
+    if len(derived) > 0:
+        if array_shards.is_shard_path(target_path):
+            os.makedirs(os.path.dirname(array_shards.split_shard_path(target_path)[0]), exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        save_arrays(target_path, derived, array_codec or read_codec(source_path), fields)
+    return [member for member in derived if not member.endswith(".config")]
@@ -0,0 +1,181 @@
+from wsrdata.download_radar_scans import setup_logger as setup_download_logger, scan_to_aws_key
+from wsrdata.render_npy_arrays import setup_logger as setup_render_logger, \
+    render_scan, record_result, scan_to_array_path, default_render_configs, members_to_render, open_journal, \
+    check_pyramid
+from wsrdata.scan_stats import StatsCatalog, check_stats
+from wsrdata.array_store import DEFAULT_CODEC, array_exists
+from wsrdata.utils.s3_utils import download_scans, download_bytes, is_not_found_error
+from wsrdata.utils.profiling import ThroughputLog
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import logging
+import os
+import queue
+import threading
+import time
+
+
+_DONE = object() # put on the queue once per render worker after all scans are downloaded
+
+
+# Download and render the scans of a scan list in one pipelined pass, so that network and cpu overlap.
+# inputs a txt file where each line is a scan name, e.g.
+# KOKX20130721_093320_V06
+# KTBW20031123_115217
+# download_workers threads download scans and hand them over to render_workers threads through a queue
+# holding at most queue_size scans. With render_workers > 1, each of these threads renders its scans in a pool
+# of render_workers processes, since rendering is mostly bound by Python code holding the GIL.
+# With keep_scans=False scans are downloaded into memory and rendered from there, without being written to
+# scan_dir; scans already in scan_dir are read from disk either way.
+# Scans whose arrays already exist are not downloaded unless force_rendering, or incremental and some of
+# their members are missing or stale (see render_scan).
+# Logs, error lists and the render journal are the same as running download_by_scan_list and then
+# render_by_scan_list, except that a scan that fails to download is also recorded as failing to load in rendering.
+# resume=True skips scans recorded in the render journal by an earlier run with the same settings.
+# timing_path optionally names a jsonl file to record the seconds of each stage of each scan, download included,
+# with bytes and peak RSS, and rolling scans/sec and ETA are then logged every report_every seconds.
+# pyramid_dims and pyramid_method also save downsampled levels of every array, and scan_stats appends statistics
+# of every rendered scan to the catalog of array_dir, as in render_by_scan_list.
+def download_and_render_by_scan_list(filepath, scan_dir, array_dir,
+                                     array_render_config, dualpol_render_config,
+                                     download_log_path, not_s3_log_path, error_scans_log_path,
+                                     force_rendering=False, download_workers=8, render_workers=1,
+                                     queue_size=32, keep_scans=True, backend=None, engine="radar2mat",
+                                     incremental=False, array_codec=DEFAULT_CODEC, array_layout="npz",
+                                     resume=False, timing_path=None, report_every=30.0,
+                                     pyramid_dims=None, pyramid_method="mean", scan_stats=None):
+
+    download_logger = setup_download_logger(download_log_path, filepath)
+    render_logger = setup_render_logger(os.path.join(array_dir, "rendering.log"), filepath)
+    download_logger.info('***** Start downloading for %s *****' % (filepath))
+    render_logger.info('***** Start rendering for %s *****' % (filepath))
+
+    scans = [scan.strip() for scan in open(filepath, "r").readlines()] # Load all scans
+    not_s3 = [] # record scans not in s3
+    error_scans = [] # record scans whose downloading fails due to reasons other than not in s3
+    render_configs = default_render_configs(array_render_config, dualpol_render_config)
+    check_pyramid(render_configs, pyramid_dims)
+    check_stats(scan_stats, render_configs)
+    errors = {name: [] for name in render_configs} # to record scans from which rendering fails, by config
+    journal, scans = open_journal(array_dir, scans, errors, render_logger, resume,
+                                  render_configs=render_configs, force_rendering=force_rendering, engine=engine,
+                                  incremental=incremental, array_codec=array_codec, array_layout=array_layout,
+                                  **({"pyramid": [pyramid_dims, pyramid_method]} if pyramid_dims else {}))
+    timing = ThroughputLog(timing_path, len(scans), "Rendered", every=report_every, report=render_logger.info) \
+        if timing_path else None
+    catalog = StatsCatalog(array_dir) if scan_stats else None
+    lock = threading.Lock() # guards loggers and the lists above
+
+    todo = queue.Queue()
+    for scan in scans:
+        todo.put(scan)
+    ready = queue.Queue(maxsize=queue_size) # (scan, scan source, download seconds) ready to render
+
+    def download():
+        while True:
+            try:
+                scan = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                item = download_one(scan)
+            except Exception as ex: # e.g. an unreadable existing npz; every scan must reach the renderers
+                item = (scan, ex, 0.0)
+            ready.put(item)
+
+    # (scan, scan source or the exception downloading it, download seconds)
+    def download_one(scan):
+        aws_key = scan_to_aws_key('%s.gz' % scan)
+        scan_file = os.path.join(scan_dir, aws_key)
+        npz_path = os.path.join(array_dir, scan_to_array_path(scan, array_layout))
+        if array_exists(npz_path) and not force_rendering and \
+                not (incremental and any(members_to_render(npz_path, render_configs))):
+            return scan, None, 0.0 # render_scan logs that arrays exist without reading the scan
+
+        start = time.time()
+        try:
+            if keep_scans or os.path.isfile(scan_file):
+                download_scans([aws_key], scan_dir, backend=backend)
+                scan_source = scan_file
+            else:
+                scan_source = download_bytes(aws_key, backend=backend)
+            with lock:
+                download_logger.info('Downloaded scan %s.gz, aws key %s' % (scan, aws_key))
+        except Exception as ex:
+            with lock:
+                if is_not_found_error(ex):
+                    download_logger.error('Error Scan %s.gz not found in s3, adding to list' % scan)
+                    not_s3.append('%s.gz' % scan)
+                else:
+                    download_logger.error('Exception while processing scan %s.gz - %s' % (scan, str(ex)))
+                    error_scans.append('%s.gz' % scan)
+            scan_source = ex
+        return scan, scan_source, time.time() - start
+
+    processes = ProcessPoolExecutor(render_workers) if render_workers > 1 else None
+
+    def render_one(scan, scan_source):
+        args = (scan, scan_source, array_dir, render_configs, force_rendering, engine, incremental, array_codec,
+                array_layout)
+        kwargs = {"pyramid_dims": pyramid_dims, "pyramid_method": pyramid_method, "scan_stats": scan_stats,
+                  "profile": timing is not None}
+        if processes is None:
+            return render_scan(*args, **kwargs)
+        return processes.submit(render_scan, *args, **kwargs).result()
+
+    def render():
+        failure = None # once recording a result fails, the queue is still drained so that downloaders never block
+        while True:
+            item = ready.get()
+            if item is _DONE:
+                if failure is not None:
+                    raise failure
+                return
+            if failure is not None:
+                continue
+            scan, scan_source, download_seconds = item
+            if not isinstance(scan_source, Exception):
+                try:
+                    result = render_one(scan, scan_source)
+                except Exception as ex: # e.g. an unreadable existing npz; keep consuming the queue
+                    scan_source = ex
+            if isinstance(scan_source, Exception):
+                result = {"scan": scan, "errors": list(render_configs), "logs": [(
+                    logging.ERROR, 'Exception while loading scan %s - %s' % (scan, str(scan_source)))]}
+            result.setdefault("stages", {})["download"] = download_seconds
+            try:
+                with lock:
+                    record_result(result, render_logger, errors, journal, timing, catalog)
+            except Exception as ex:
+                failure = ex
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers + render_workers) as executor:
+            downloaders = [executor.submit(download) for _ in range(download_workers)]
+            renderers = [executor.submit(render) for _ in range(render_workers)]
+            try:
+                for future in downloaders:
+                    future.result()
+            finally:
+                for _ in range(render_workers):
+                    ready.put(_DONE)
+            for future in renderers:
+                future.result()
+    finally:
+        if processes is not None:
+            processes.shutdown()
+
+    if len(not_s3) > 0:
+        with open(not_s3_log_path, 'a+') as f:
+            f.write('\n'.join(not_s3)+'\n')
+    if len(error_scans) > 0:
+        with open(error_scans_log_path, 'a+') as f:
+            f.write('\n'.join(error_scans)+'\n')
+    journal.close()
+    if timing is not None:
+        timing.close()
+    if catalog is not None:
+        catalog.close()
+
+    download_logger.info('***** Finished downloading for file %s *****' % (filepath))
+    render_logger.info('***** Finished rendering for file %s *****' % (filepath))
+    return ({"not_s3": not_s3, "error_scans": error_scans},) + tuple(errors.values())
@@ -1,16 +1,12 @@
-from wsrdata.utils.s3_utils import download_scans
-from botocore.exceptions import ClientError
+from wsrdata.utils.s3_utils import download_scans, is_not_found_error
+from wsrdata.utils.profiling import ThroughputLog
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
 import time
 
 
-# inputs a txt file where each line is a scan name, e.g.
-# KOKX20130721_093320_V06
-# KTBW20031123_115217
-def download_by_scan_list(filepath, out_dir, log_path,
-                          not_s3_log_path, # scans that are not found in s3
-                          error_scans_log_path):
-
+def setup_logger(log_path, filepath):
     logger = logging.getLogger(__name__)
     if not logger.handlers:
         filelog = logging.FileHandler(log_path)
@@ -19,38 +15,96 @@ def download_by_scan_list(filepath, out_dir, log_path,
         filelog.setFormatter(formatter)
         logger.setLevel(logging.DEBUG)
         logger.addHandler(filelog)
-    logger = logging.LoggerAdapter(logger, {"fname": filepath})
+    return logging.LoggerAdapter(logger, {"fname": filepath})
+
+
+# convert a scan name to its aws key, e.g.
+# KOKX20130721_093320_V06.gz -> 2013/07/21/KOKX/KOKX20130721_093320_V06.gz
+def scan_to_aws_key(scan):
+    station = scan[0:4]
+    year = scan[4:8]
+    month = scan[8:10]
+    date = scan[10:12]
+    return '%s/%s/%s/%s/%s' % (year, month, date, station, scan)
+
+
+# download one scan and return None on success, or "not_s3" / "error" together with a log message
+# transient s3 errors are already retried by download_scans
+def _download_one_scan(scan, out_dir, verify_existing=False, backend=None):
+    try:
+        aws_key = scan_to_aws_key(scan)
+        print(aws_key)
+        download_scans([aws_key], out_dir, verify_existing=verify_existing, backend=backend)
+        return None, 'Downloaded scan %s, aws key %s' % (scan, aws_key)
+    except Exception as ex:
+        if is_not_found_error(ex):
+            return "not_s3", 'Error Scan %s not found in s3, adding to list' % scan
+        return "error", 'Exception while processing scan %s - %s' % (scan, str(ex))
+
+
+# _download_one_scan that also returns a timing record with the seconds it took and the bytes of the scan file
+def _timed_download_one_scan(scan, out_dir, verify_existing=False, backend=None):
+    start = time.time()
+    status, message = _download_one_scan(scan, out_dir, verify_existing, backend)
+    seconds = time.time() - start
+    scan_file = os.path.join(out_dir, scan_to_aws_key(scan))
+    bytes_in = os.path.getsize(scan_file) if status is None and os.path.isfile(scan_file) else 0
+    return status, message, {"scan": scan, "status": status or "ok", "seconds": seconds,
+                             "stages": {"download": seconds}, "bytes_in": bytes_in}
+
+
+# inputs a txt file where each line is a scan name, e.g.
+# KOKX20130721_093320_V06
+# KTBW20031123_115217
+# max_workers > 1 downloads that many scans concurrently from a thread pool within this process,
+# instead of launching this function multiple times in parallel with split scan lists;
+# verify_existing redownloads previously downloaded scans whose size does not match s3;
+# backend is a storage backend from wsrdata.utils.storage_backends, default s3;
+# timing_path optionally names a jsonl file to record the seconds and bytes of each download, and
+# rolling scans/sec and ETA are then logged every report_every seconds (see wsrdata.utils.profiling)
+def download_by_scan_list(filepath, out_dir, log_path,
+                          not_s3_log_path, # scans that are not found in s3
+                          error_scans_log_path,
+                          max_workers=1, verify_existing=False, backend=None,
+                          timing_path=None, report_every=30.0):
+
+    logger = setup_logger(log_path, filepath)
 
     logger.info('***** Start downloading for %s *****' % (filepath))
 
     # Load all scans
-    scans = [scan.strip() for scan in open(filepath, "r").readlines()] # Load all scans
+    scans = ['%s.gz' % scan.strip() for scan in open(filepath, "r").readlines()] # Load all scans
     not_s3 = [] # record scans not in s3
     error_scans = [] # record scans whose downloading fails due to reasons other than not in s3
+    timing = ThroughputLog(timing_path, len(scans), "Downloaded", every=report_every, report=logger.info) \
+        if timing_path else None
+
+    # download each scan, serially or from a bounded pool of threads;
+    # results are consumed in the scan list order so that logs and error lists are deterministic
+    if max_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        results = executor.map(lambda scan: _timed_download_one_scan(scan, out_dir, verify_existing, backend), scans)
+    else:
+        executor = None
+        results = (_timed_download_one_scan(scan, out_dir, verify_existing, backend) for scan in scans)
 
-    # download each scan
-    for scan in scans:
-        try:
-            scan = '%s.gz' % scan
-            station = scan[0:4]
-            year = scan[4:8]
-            month = scan[8:10]
-            date = scan[10:12]
-            aws_key = '%s/%s/%s/%s/%s' % (year, month, date, station, scan)
-            print(aws_key)
-            download_scans([aws_key], out_dir)
-            logger.info('Downloaded scan %s, aws key %s' % (scan, aws_key))
-        except ClientError as err:
-            error_code = int(err.response['Error']['Code'])
-            if error_code == 404:
-                logger.error('Error Scan %s not found in s3, adding to list' % scan)
+    try:
+        for scan, (status, message, record) in zip(scans, results):
+            if timing is not None:
+                timing.record(record)
+            if status is None:
+                logger.info(message)
+            elif status == "not_s3":
+                logger.error(message)
                 not_s3.append(scan)
             else:
-                logger.error('Exception while processing scan %s - %s' % (scan, str(err)))
+                logger.error(message)
                 error_scans.append(scan)
-        except Exception as ex:
-            logger.error('Exception while processing scan %s - %s' % (scan, str(ex)))
-            error_scans.append(scan)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if timing is not None:
+            timing.close()
 
     if len(not_s3) > 0:
         with open(not_s3_log_path, 'a+') as f:
@@ -61,4 +115,4 @@ def download_by_scan_list(filepath, out_dir, log_path,
             f.write('\n'.join(error_scans)+'\n')
 
     logger.info('***** Finished downloading for file %s *****' % (filepath))
-    return {"not_s3": not_s3, "error_scans": error_scans}
\ No newline at end of file
+    return {"not_s3": not_s3, "error_scans": error_scans}
@@ -0,0 +1,248 @@
+"""
+An experimental rendering engine for Cartesian nearest-neighbor configs, i.e. coords='cartesian' and
+interp_method='nearest', which are what all prepare scripts use. It is opt-in (engine="indexed"); radar2mat
+remains the reference renderer, and the two have not yet been compared on real scans, so arrays rendered by
+this engine are not known to equal those of radar2mat. Run tools/compare_render_engines.py on real scans of a
+version, which reports the fraction of mismatched pixels and the max absolute and relative differences, before
+rendering a version with it.
+
+A pixel takes the value of the nearest bin of a polar grid with r_res (ground or slant) range and az_res
+azimuth resolution, and a polar bin takes the value of the nearest gate and ray of the sweep selected for its
+field and elevation. Which polar bin a pixel falls in depends only on the config, and which
+gate and ray a polar bin takes depends only on the sweep geometry, so both are computed once and cached, and
+rendering a field of a sweep is a single np.take of the flattened sweep data with a cached index map.
+
+Sweep selection: for each field and requested elevation, among the sweeps that have data for the field, the
+one with the nearest fixed angle is used, breaking ties (e.g. the surveillance and Doppler cuts of a split cut)
+by the number of valid gates. An elevation farther than elev_tolerance degrees from every such sweep fails.
+This rule is this engine's own; radar2mat may select other sweeps of split cuts.
+
+Arrays are returned as OUTPUT_DTYPE, so that the arrays of an ARRAY_VERSION have one dtype whichever engine
+rendered them; tools/compare_render_engines.py also reports the dtypes of both engines.
+"""
+
+from collections import OrderedDict
+import hashlib
+import threading
+import numpy as np
+
+
+EARTH_RADIUS = 6371000.0 # meters
+EFFECTIVE_EARTH_RADIUS = 4. / 3. * EARTH_RADIUS # standard refraction model
+OUTPUT_DTYPE = np.float64 # as radar2mat arrays are expected to be; check with tools/compare_render_engines.py
+SUPPORTED_KEYS = {"ydirection", "fields", "coords", "r_min", "r_max", "r_res", "az_res", "dim",
+                  "sweeps", "elevs", "use_ground_range", "interp_method"}
+max_cached_maps = 64 # index maps kept per process, each dim x dim int64
+
+_cache_lock = threading.Lock()
+_grid_cache = OrderedDict() # config -> polar bin of each pixel
+_map_cache = OrderedDict() # (config, sweep geometry) -> flat gate index of each pixel
+
+
+def check_config(config):
+    """Raise ValueError if a render config cannot be rendered by this engine"""
+    unsupported = set(config) - SUPPORTED_KEYS
+    if unsupported:
+        raise ValueError("render config keys %s are not supported by the indexed engine" % sorted(unsupported))
+    if config.get("coords", "polar") != "cartesian" or config.get("interp_method", "nearest") != "nearest":
+        raise ValueError("the indexed engine only renders coords='cartesian' with interp_method='nearest'")
+    if config.get("sweeps") is not None:
+        raise ValueError("the indexed engine selects sweeps by elevs; sweeps must be None")
+
+
+def ground_range(slant_range, elevation):
+    """Ground range (m) of gates at slant_range (m) on a beam at elevation (degrees), under 4/3 earth refraction"""
+    theta = np.deg2rad(elevation)
+    height = np.sqrt(slant_range ** 2 + EFFECTIVE_EARTH_RADIUS ** 2 +
+                     2 * slant_range * EFFECTIVE_EARTH_RADIUS * np.sin(theta)) - EFFECTIVE_EARTH_RADIUS
+    return EFFECTIVE_EARTH_RADIUS * np.arcsin(slant_range * np.cos(theta) / (EFFECTIVE_EARTH_RADIUS + height))
+
+
+def _lru_get(cache, key, compute):
+    with _cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = compute()
+    with _cache_lock:
+        cache[key] = value
+        while len(cache) > max_cached_maps:
+            cache.popitem(last=False)
+    return value
+
+
+def _geometry_key(config):
+    return tuple(config.get(k) for k in ("ydirection", "r_min", "r_max", "r_res", "az_res", "dim"))
+
+
+def cartesian_grid(config):
+    """Polar bin of every pixel of a config, cached
+
+    Returns:
+        (range_bin, az_bin, n_range_bins, n_az_bins, y, x) where range_bin is -1 outside [r_min, r_max]
+    """
+    def compute():
+        r_min, r_max, r_res = config["r_min"], config["r_max"], config["r_res"]
+        az_res, dim = config["az_res"], config["dim"]
+        x = y = np.linspace(-r_max, r_max, dim)
+        if config.get("ydirection", "xy") == "ij":
+            y = y[::-1]
+        X, Y = np.meshgrid(x, y)
+        R = np.hypot(X, Y)
+        PHI = np.mod(90. - np.rad2deg(np.arctan2(Y, X)), 360.) # compass heading
+
+        n_range_bins = int(np.floor((r_max - r_min) / r_res + 1e-9)) + 1
+        n_az_bins = int(round(360. / az_res))
+        range_bin = np.rint((R - r_min) / r_res).astype(np.int64)
+        range_bin[(range_bin < 0) | (range_bin >= n_range_bins)] = -1
+        az_bin = np.mod(np.rint(PHI / az_res).astype(np.int64), n_az_bins)
+        return range_bin, az_bin, n_range_bins, n_az_bins, y, x
+
+    return _lru_get(_grid_cache, _geometry_key(config), compute)
+
+
+def _nearest_gates(gate_ranges, targets):
+    # index of the gate nearest to each target range, -1 if beyond half a gate from the first or last gate
+    spacing = np.median(np.diff(gate_ranges)) if len(gate_ranges) > 1 else np.inf
+    right = np.clip(np.searchsorted(gate_ranges, targets), 1, len(gate_ranges) - 1) if len(gate_ranges) > 1 \
+        else np.zeros(len(targets), dtype=np.int64)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(np.abs(gate_ranges[right] - targets) < np.abs(gate_ranges[left] - targets), right, left)
+    nearest[np.abs(gate_ranges[nearest] - targets) > spacing / 2] = -1
+    return nearest
+
+
+def _nearest_rays(azimuths, targets):
+    # index of the ray nearest to each target azimuth, on the circle
+    order = np.argsort(azimuths)
+    sorted_az = azimuths[order]
+    extended = np.concatenate([sorted_az[-1:] - 360., sorted_az, sorted_az[:1] + 360.])
+    right = np.searchsorted(extended, targets)
+    right = np.clip(right, 1, len(extended) - 1)
+    left = right - 1
+    nearest = np.where(extended[right] - targets < targets - extended[left], right, left)
+    return order[(nearest - 1) % len(order)]
+
+
+def index_map(config, sweep):
+    """Flat index into the sweep data (rays x gates, plus one trailing NaN) of every pixel, cached
+
+    Args:
+        config (dict): render config
+        sweep (dict): with "azimuth" (degrees per ray), "range" (slant range per gate, m) and "elevation" (degrees)
+    """
+    range_bin, az_bin, n_range_bins, n_az_bins, _, _ = cartesian_grid(config)
+
+    bin_ranges = config["r_min"] + config["r_res"] * np.arange(n_range_bins)
+    gate_ranges = sweep["range"]
+    if config.get("use_ground_range", True):
+        gate_ranges = ground_range(gate_ranges, sweep["elevation"])
+    gate_of_bin = _nearest_gates(gate_ranges, bin_ranges)
+    ray_of_bin = _nearest_rays(np.asarray(sweep["azimuth"], dtype=np.float64), config["az_res"] * np.arange(n_az_bins))
+    n_rays, n_gates = len(sweep["azimuth"]), len(sweep["range"])
+
+    layout = hashlib.sha1(gate_of_bin.tobytes() + ray_of_bin.tobytes()).hexdigest()
+    key = (_geometry_key(config), n_rays, n_gates, layout)
+
+    def compute():
+        gate = np.where(range_bin >= 0, gate_of_bin[range_bin], -1)
+        flat = ray_of_bin[az_bin] * n_gates + gate
+        flat[gate < 0] = n_rays * n_gates # the trailing NaN
+        return flat
+
+    return _lru_get(_map_cache, key, compute)
+
+
+def extract_sweeps(radar, fields, elevs, elev_tolerance=0.5):
+    """Select and extract the polar data rendered for each field and elevation
+
+    Args:
+        radar (pyart.core.Radar): radar scan
+        fields (list of strings): field names
+        elevs (list of floats): elevations in degrees
+        elev_tolerance (float): max difference in degrees between a requested and a selected elevation
+
+    Returns:
+        dict from field name to a dict from each requested elevation to its sweep; a sweep is a dict with
+        "azimuth" (rays), "range" (gates), "elevation" (fixed angle) and "data" (rays x gates, NaN if missing)
+    """
+    fixed_angles = np.asarray(radar.fixed_angle['data'], dtype=np.float64)
+    ranges = np.asarray(radar.range['data'], dtype=np.float64)
+    polar = {}
+    for field in fields:
+        if field not in radar.fields:
+            raise ValueError("field %s is not in the radar scan" % field)
+        field_data = radar.fields[field]['data']
+        mask = np.ma.getmaskarray(field_data)
+        valid_gates = {} # sweep -> number of gates with data for this field, counted only near requested elevs
+
+        polar[field] = {}
+        for elev in elevs:
+            near = [sweep for sweep in range(radar.nsweeps) if abs(fixed_angles[sweep] - elev) <= elev_tolerance]
+            for sweep in near:
+                if sweep not in valid_gates:
+                    sweep_mask = mask[radar.get_slice(sweep)]
+                    valid_gates[sweep] = sweep_mask.size - np.count_nonzero(sweep_mask)
+            near = [sweep for sweep in near if valid_gates[sweep] > 0]
+            if not near:
+                raise ValueError("Failed to match at least one requested elevation")
+            best = min(near, key=lambda sweep: (round(abs(fixed_angles[sweep] - elev), 3), -valid_gates[sweep]))
+            rays = radar.get_slice(best)
+            polar[field][float(elev)] = {
+                "azimuth":      np.asarray(radar.azimuth['data'][rays], dtype=np.float32),
+                "range":        ranges,
+                "elevation":    float(fixed_angles[best]),
+                "data":         _padded(np.ma.getdata(field_data)[rays], mask[rays]),
+            }
+    return polar
+
+
+def _padded(values, mask):
+    # float32 copy of values with NaN where masked, as a view of a flat buffer ending with one extra NaN,
+    # so that render_polar can take from the buffer without copying it again
+    flat = np.empty(values.size + 1, dtype=np.float32)
+    data = flat[:-1].reshape(values.shape)
+    data[...] = values
+    data[mask] = np.nan
+    flat[-1] = np.nan
+    return data
+
+
+def _flat_with_nan(data):
+    # the flat buffer of data with one trailing NaN, without a copy if data came from _padded
+    base = data.base
+    if base is not None and base.ndim == 1 and base.size == data.size + 1 and data.flags.c_contiguous \
+            and base.ctypes.data == data.ctypes.data and np.isnan(base[-1]):
+        return base
+    return np.append(np.asarray(data, dtype=np.float32).ravel(), np.float32(np.nan))
+
+
+def render_polar(polar, config):
+    """Render a config from extracted sweeps, one np.take per field and elevation
+
+    Args:
+        polar (dict): from extract_sweeps, with at least the fields and elevations of config
+        config (dict): render config
+
+    Returns:
+        (data, fields, elevs, y, x) where data is fields x elevs x dim x dim
+    """
+    check_config(config)
+    _, _, _, _, y, x = cartesian_grid(config)
+    dim = config["dim"]
+    data = np.empty((len(config["fields"]), len(config["elevs"]), dim, dim), dtype=OUTPUT_DTYPE)
+    for i, field in enumerate(config["fields"]):
+        for j, elev in enumerate(config["elevs"]):
+            sweep = polar[field][float(elev)]
+            flat = _flat_with_nan(sweep["data"])
+            data[i, j] = np.take(flat, index_map(config, sweep)) # float32 sweeps, OUTPUT_DTYPE pixels
+    elevs = [polar[config["fields"][0]][float(elev)]["elevation"] for elev in config["elevs"]]
+    return data, list(config["fields"]), elevs, y, x
+
+
+def render_indexed(radar, elev_tolerance=0.5, **config):
+    """Render a Cartesian nearest-neighbor config with the arguments and return values of radar2mat; the arrays
+    are not known to equal those of radar2mat until compared with tools/compare_render_engines.py"""
+    check_config(config)
+    polar = extract_sweeps(radar, config["fields"], config["elevs"], elev_tolerance)
+    return render_polar(polar, config)
@@ -0,0 +1,87 @@
+"""
+An append-only journal of rendered scans, so that long rendering jobs can resume after a crash or preemption.
+
+Each scan handled by a rendering job is recorded as one json line in array_dir/render_journal.jsonl, e.g.
+{"scan": "KOKX20130721_093320_V06", "status": "ok", "members": ["array", "dualpol_array"], "errors": [],
+ "seconds": 3.2, "time": "2021-05-01T10:00:00Z", "job": "5f1c..."}
+where status is "ok", "error" if any member failed, "skipped" if nothing needed rendering, or "timeout",
+"memory" or "crashed" if the worker rendering the scan was killed or died (see wsrdata.utils.worker_pool),
+and job is a signature of the render settings. The scans of a failed member are also appended to the error logs
+right away rather than at the end of the job, and killed scans to killed_scans.log as "<scan> <status>".
+A resumed job skips scans recorded with the same job signature.
+A line is flushed as soon as it is written; a line truncated by a crash is ignored when reading.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+
+JOURNAL_NAME = "render_journal.jsonl"
+KILLED_LOG_NAME = "killed_scans.log"
+KILLED_STATUSES = ("timeout", "memory", "crashed")
+
+
+def job_signature(**settings):
+    """Signature of render settings, e.g. job_signature(render_configs=..., force_rendering=...)"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+class RenderJournal:
+    """Journal of the rendering jobs of an array directory
+
+    Args:
+        array_dir (string): directory of rendered arrays, where the journal and error logs are written
+        job (string): signature of the current job, see job_signature
+        error_log_name (function): from a member name to the name of its error log in array_dir
+    """
+
+    def __init__(self, array_dir, job, error_log_name):
+        self.path = os.path.join(array_dir, JOURNAL_NAME)
+        self.array_dir = array_dir
+        self.job = job
+        self.error_log_name = error_log_name
+        with open(self.path, "a+b") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n": # end a line left truncated by a crash, so the next record starts a line
+                    f.write(b"\n")
+        self._file = open(self.path, "a")
+
+    def completed(self):
+        """Dict from scans recorded with the current job signature to their latest records"""
+        records = {}
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # a line truncated by a crash
+                if record.get("job") == self.job:
+                    records[record["scan"]] = record
+        return records
+
+    def record(self, result):
+        """Append a render_scan result to the journal and the scans of its errors to the error logs"""
+        for name in result["errors"]:
+            with open(os.path.join(self.array_dir, self.error_log_name(name)), "a+") as f:
+                f.write(result["scan"] + "\n")
+        members = result.get("members", [])
+        status = result.get("status") or ("error" if result["errors"] else ("ok" if members else "skipped"))
+        if status in KILLED_STATUSES:
+            with open(os.path.join(self.array_dir, KILLED_LOG_NAME), "a+") as f:
+                f.write("%s %s\n" % (result["scan"], status))
+        self._file.write(json.dumps({
+            "scan":     result["scan"],
+            "status":   status,
+            "members":  members,
+            "errors":   result["errors"],
+            "seconds":  round(result.get("seconds", 0.0), 3),
+            "time":     time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "job":      self.job,
+        }) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
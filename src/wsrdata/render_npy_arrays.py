@@ -1,22 +1,31 @@
 from wsrlib import pyart, radar2mat
+from wsrdata.render_engine import render_indexed
+from wsrdata.array_store import DEFAULT_CODEC, save_arrays, append_arrays, load_arrays, read_headers, array_exists, \
+    stored_size, pyramid_member
+from wsrdata.render_journal import RenderJournal, job_signature
+from wsrdata.sweep_cache import CachedScan, open_cache, render_cached
+from wsrdata.scan_stats import StatsCatalog, check_stats, compute_stats
+from wsrdata.render_schedule import read_timings, fit_cost_model, schedule_by_cost, scan_file_sizes
+from wsrdata.utils.array_utils import pyramid
+from wsrdata.utils.profiling import StageTimer, NullTimer, ThroughputLog, RssSampler
+from wsrdata.utils.worker_pool import WorkerPool, WorkerError, TaskTimeout, MemoryLimitExceeded, WorkerDied
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import contextlib
+import gzip
+import io
+import json
 import logging
+import multiprocessing
 import time
 import os
+import zipfile
+import zlib
 import numpy as np
 
 
-# inputs a txt file where each line is a scan name, e.g.
-# KOKX20130721_093320_V06
-# KTBW20031123_115217
-def render_by_scan_list(filepath, scan_dir, array_dir,
-                        array_render_config, dualpol_render_config,
-                        force_rendering=False):
-
-    log_path = os.path.join(array_dir, "rendering.log")
-        # this includes successful rendering for arrays and dualpol arrays
-    array_error_log_path = os.path.join(array_dir, "array_error_scans.log")
-    dualpol_error_log_path = os.path.join(array_dir, "dualpol_error_scans.log")
-
+def setup_logger(log_path, filepath):
     logger = logging.getLogger(__name__)
     if not logger.handlers:
         filelog = logging.FileHandler(log_path)
@@ -25,72 +34,583 @@ def render_by_scan_list(filepath, scan_dir, array_dir,
         filelog.setFormatter(formatter)
         logger.setLevel(logging.DEBUG)
         logger.addHandler(filelog)
-    logger = logging.LoggerAdapter(logger, {"fname": filepath})
+    return logging.LoggerAdapter(logger, {"fname": filepath})
 
-    logger.info('***** Start rendering for %s *****' % (filepath))
 
-    scans = [scan.strip() for scan in open(filepath, "r").readlines()] # Load all scans
-    array_errors = [] # to record scans from which array rendering fails
-    dualpol_errors = [] # to record scans from which dualpol array rendering fails
+# a scan source is either the path of a downloaded scan or the (possibly gzipped) bytes of a scan in memory
+def read_scan(scan_source):
+    if isinstance(scan_source, bytes):
+        if scan_source[:2] == b'\x1f\x8b':
+            scan_source = gzip.decompress(scan_source)
+        scan_source = io.BytesIO(scan_source)
+    return pyart.io.read_nexrad_archive(scan_source)
+
+
+# read a scan file into memory and gunzip it, so that read_scan only parses it, e.g. on a read-ahead thread
+# since file reads and zlib release the GIL; returns the path itself if the file cannot be read or
+# decompressed, for read_scan to report the error
+def load_scan(scan_file):
+    try:
+        with open(scan_file, "rb") as f:
+            data = f.read()
+        return gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data
+    except (OSError, EOFError, zlib.error):
+        return scan_file
+
+
+# layouts of array files under array_dir: "npz" writes one npz per scan, e.g.
+# 2013/07/21/KOKX/KOKX20130721_093320_V06.npz;
+# "shard-day" and "shard-month" pack the npz of all scans of a station-day or station-month into one shard
+# with an index, e.g. 2013/07/21/KOKX.shard, where a scan has the array path
+# 2013/07/21/KOKX.shard#KOKX20130721_093320_V06 (see wsrdata.array_shards)
+ARRAY_LAYOUTS = ("npz", "shard-day", "shard-month")
+
+
+# array path of a scan relative to array_dir, as recorded in dataset json files
+def scan_to_array_path(scan, array_layout="npz"):
+    station = scan[0:4]
+    year = scan[4:8]
+    month = scan[8:10]
+    date = scan[10:12]
+    if array_layout == "npz":
+        return f"{year}/{month}/{date}/{station}/{scan}.npz"
+    if array_layout == "shard-day":
+        return f"{year}/{month}/{date}/{station}.shard#{scan}"
+    if array_layout == "shard-month":
+        return f"{year}/{month}/{station}.shard#{scan}"
+    raise ValueError("unknown array layout %s" % array_layout)
+
+
+# npz members rendered by default, with the descriptions used in rendering.log
+DEFAULT_MEMBER_DESCRIPTIONS = {"array": "npy array", "dualpol_array": "dualpol npy array"}
+
+
+def default_render_configs(array_render_config, dualpol_render_config):
+    return {"array": array_render_config, "dualpol_array": dualpol_render_config}
+
+
+def error_log_name(member):
+    if member == "array":
+        return "array_error_scans.log"
+    if member == "dualpol_array":
+        return "dualpol_error_scans.log"
+    return f"{member}_error_scans.log"
+
+
+def expected_shape(render_config):
+    return (len(render_config["fields"]), len(render_config["elevs"]), render_config["dim"], render_config["dim"])
+
+
+# each rendered npz member is saved along with a member recording its render config as a json string,
+# e.g. "array" and "array.config", so that incremental rendering can tell whether a member is stale
+def config_member(name):
+    return name + ".config"
+
+
+def encode_config(render_config):
+    return np.array(json.dumps(render_config, sort_keys=True))
+
+
+# errors of reading an npz that is cut short or corrupt, e.g. one left by a crash of a run that did not write
+# npz files atomically
+UNREADABLE_NPZ_ERRORS = (zipfile.BadZipFile, ValueError, OSError, EOFError, zlib.error)
+
+
+# names of render_configs whose member is missing from an existing npz, and of those whose member is stale,
+# i.e. recorded with a different config, or without a recorded config and of a different shape than expected;
+# every member of an npz that cannot be read is stale, so that the npz is rendered and written again
+def members_to_render(npz_path, render_configs):
+    try:
+        headers = read_headers(npz_path)
+        recorded = load_arrays(npz_path, [config_member(name) for name in render_configs
+                                          if name in headers and config_member(name) in headers])
+    except UNREADABLE_NPZ_ERRORS:
+        return [], list(render_configs)
+    missing, stale = [], []
+    for name, config in render_configs.items():
+        if name not in headers:
+            missing.append(name)
+        elif config_member(name) in recorded:
+            if str(recorded[config_member(name)]) != str(encode_config(config)):
+                stale.append(name)
+        elif headers[name][0] != expected_shape(config):
+            stale.append(name)
+    return missing, stale
+
+
+# render several named configs from one radar read;
+# configs that share every parameter except "fields" are rendered by a single radar2mat call over
+# the union of their fields, so sweep selection and gridding are done once for them. Configs with fields the
+# scan lacks, e.g. dualpol configs of a legacy scan, are left out of that call and rendered separately, so that
+# only they fail; an exception of a single call fails all of its configs.
+# engine is "radar2mat", or "indexed" for the cached index-map renderer in wsrdata.render_engine
+# timer optionally records the time of each render call as a stage "render:<names rendered>"
+# radar may also be a wsrdata.sweep_cache.CachedScan, rendered by the indexed engine from cached sweeps; its
+# fields are only known once its sweeps are extracted, so a single call failing to extract them, which raises
+# ValueError before rendering anything, is followed by rendering the configs separately
+# logs optionally collects (level, message) records of configs rendered separately
+# returns a dict from each name to its rendered array, or to the exception raised while rendering it
+def render_arrays(radar, render_configs, engine="radar2mat", timer=None, logs=None):
+    if isinstance(radar, CachedScan):
+        render = render_cached
+    else:
+        render = radar2mat if engine == "radar2mat" else render_indexed
+    groups = {} # geometry -> names of configs with that geometry
+    for name, config in render_configs.items():
+        geometry = tuple(sorted((k, repr(v)) for k, v in config.items() if k != "fields"))
+        groups.setdefault(geometry, []).append(name)
+
+    timer = timer or StageTimer()
+    logs = [] if logs is None else logs
+    rendered = {}
+    for names in groups.values():
+        if not isinstance(radar, CachedScan):
+            lacking = [name for name in names if any(f not in radar.fields for f in render_configs[name]["fields"])]
+            if len(lacking) > 0 and len(names) > 1:
+                logs.append((logging.INFO, 'Rendering %s separately - the scan lacks some of their fields' %
+                             ", ".join(lacking)))
+            combined = [name for name in names if name not in lacking]
+        else:
+            lacking, combined = [], names
+        if len(combined) > 1:
+            fields = []
+            for name in combined:
+                fields.extend(f for f in render_configs[name]["fields"] if f not in fields)
+            config = dict(render_configs[combined[0]], fields=fields)
+            try:
+                with timer.stage("render:" + "+".join(combined)):
+                    data, _, _, y, x = render(radar, **config)
+                for name in combined:
+                    rendered[name] = data[[fields.index(f) for f in render_configs[name]["fields"]]]
+                combined = []
+            except Exception as ex:
+                if not isinstance(radar, CachedScan) or not isinstance(ex, ValueError):
+                    rendered.update((name, ex) for name in combined)
+                    combined = []
+                else:
+                    logs.append((logging.INFO, 'Rendering %s separately - %s' % (", ".join(combined), str(ex))))
+
+        for name in lacking + combined:
+            try:
+                with timer.stage("render:" + name):
+                    data, _, _, y, x = render(radar, **render_configs[name])
+                rendered[name] = data
+            except Exception as ex:
+                rendered[name] = ex
+
+    return rendered
+
+
+# render arrays from one scan and save them as npz members named by render_configs;
+# with incremental=True, an existing npz is completed rather than skipped: only members that are missing
+# or stale (see members_to_render) are rendered. Missing members are appended to the npz without
+# recompressing the others; a stale member requires rewriting the whole npz.
+# array_codec selects how new npz files are compressed (see wsrdata.array_store); appended members use
+# the codec of the existing npz. array_layout is one of ARRAY_LAYOUTS.
+# With a wsrdata.sweep_cache.SweepCache and engine="indexed", sweeps are rendered from the cache, and the scan
+# is only read if some of them are not cached yet.
+# pyramid_dims, e.g. [300, 150], also saves each rendered array downsampled to those sizes by pyramid_method
+# ("mean" or "max" of valid pixels) as members "<name>@<dim>", read with wsrdata.array_store.load_level.
+# scan_stats, e.g. ["mean_dbz", "dualpol"], computes those statistics (see wsrdata.scan_stats) of the arrays
+# of the scan while they are in memory as result["stats"]; with incremental rendering, the members that already
+# exist are read back for them.
+# defer_save=True leaves saving the rendered arrays to the caller, which must call save_result on the result,
+# e.g. on a write-behind thread.
+# profile=True also times the stages of the scan and samples the peak RSS of the process while rendering it
+# (see RssSampler) on a thread, for timing logs.
+# returns a dict with log records as (level, message), the members whose rendering failed, the members written,
+# the statistics if any, the seconds it took, bytes read and written, and if profiled the seconds by stage and
+# the peak RSS, so that callers running scans concurrently can log and collect errors and timings in one place
+def render_scan(scan, scan_source, array_dir, render_configs, force_rendering=False, engine="radar2mat",
+                incremental=False, array_codec=DEFAULT_CODEC, array_layout="npz", sweep_cache=None,
+                pyramid_dims=None, pyramid_method="mean", scan_stats=None, defer_save=False, profile=False):
+    start = time.time()
+    args = (scan, scan_source, array_dir, render_configs, force_rendering, engine, incremental, array_codec,
+            array_layout, sweep_cache, pyramid_dims, pyramid_method, scan_stats)
+    if profile:
+        timer = StageTimer()
+        with RssSampler() as memory:
+            result = _render_scan(*args, timer)
+        result["stages"] = timer.seconds
+        result["scan_peak_rss_mb"] = memory.peak_mb
+    else:
+        result = _render_scan(*args, NullTimer())
+    result["seconds"] = time.time() - start
+    return result if defer_save else save_result(result)
+
+
+# save the arrays of a render_scan(..., defer_save=True) result, adding the time it took to the result
+def save_result(result):
+    save = result.pop("save", None)
+    if save is not None:
+        start = time.time()
+        result["bytes_out"] = save()
+        seconds = time.time() - start
+        if "stages" in result:
+            result["stages"]["save"] = seconds
+        result["seconds"] += seconds
+    return result
+
+
+def _save_rendered(npz_path, arrays, fields, append, array_codec):
+    if append:
+        append_arrays(npz_path, arrays, fields)
+    else:
+        os.makedirs(os.path.dirname(npz_path), exist_ok=True)
+        save_arrays(npz_path, arrays, array_codec, fields)
+    return stored_size(npz_path)
 
-    # render arrays from scans
-    for scan in scans:
-        station = scan[0:4]
-        year = scan[4:8]
-        month = scan[8:10]
-        date = scan[10:12]
-        scan_file = os.path.join(scan_dir, f"{year}/{month}/{date}/{station}/{scan}.gz")
-        arrays = {}
-        npz_path = os.path.join(array_dir, f"{year}/{month}/{date}/{station}/{scan}.npz")
-
-        if os.path.exists(npz_path):
-            if force_rendering:
-                arrays = np.load(npz_path)
-            else:
-                logger.info('Rendered arrays already exist for scan %s' % scan)
-                continue
 
+def _render_scan(scan, scan_source, array_dir, render_configs, force_rendering, engine,
+                 incremental, array_codec, array_layout, sweep_cache, pyramid_dims, pyramid_method, scan_stats, timer):
+    result = {"scan": scan, "logs": [], "errors": [], "members": [], "bytes_in": 0, "bytes_out": 0}
+    arrays = {}
+    stats_configs = render_configs # all members, including those not rendered again
+    append = False # whether to append the rendered members to the existing npz
+    npz_path = os.path.join(array_dir, scan_to_array_path(scan, array_layout))
+
+    with timer.stage("check"):
+        exists = array_exists(npz_path)
+    if exists:
+        if incremental and not force_rendering:
+            with timer.stage("check"):
+                missing, stale = members_to_render(npz_path, render_configs)
+            if len(missing) == 0 and len(stale) == 0:
+                result["logs"].append((logging.INFO, 'Rendered arrays already exist for scan %s' % scan))
+                return result
+            render_configs = {name: config for name, config in render_configs.items()
+                              if name in missing or name in stale}
+            result["logs"].append((logging.INFO, 'Rendering %s for existing arrays of scan %s' %
+                                   (", ".join(render_configs), scan)))
+            append = len(stale) == 0
+        elif not force_rendering:
+            result["logs"].append((logging.INFO, 'Rendered arrays already exist for scan %s' % scan))
+            return result
+        if not append:
+            with timer.stage("load"):
+                try:
+                    arrays = load_arrays(npz_path)
+                except UNREADABLE_NPZ_ERRORS as ex:
+                    result["logs"].append((logging.WARNING, 'Existing arrays of scan %s cannot be read and are '
+                                                            'rendered again - %s' % (scan, str(ex))))
+
+    def read():
+        with timer.stage("read"):
+            if isinstance(scan_source, bytes):
+                result["bytes_in"] = len(scan_source)
+            elif isinstance(scan_source, str) and os.path.isfile(scan_source):
+                result["bytes_in"] = os.path.getsize(scan_source)
+            return read_scan(scan_source)
+
+    if sweep_cache is not None and engine == "indexed":
+        radar = CachedScan(sweep_cache, scan, read)
+        rendered = render_arrays(radar, render_configs, engine, timer, result["logs"])
+        if radar.read_error is not None:
+            result["logs"].append((logging.ERROR, 'Exception while loading scan %s - %s' %
+                                   (scan, str(radar.read_error))))
+            result["errors"] = list(render_configs)
+            return result
+        result["logs"].append((logging.INFO, 'Loaded scan %s' % scan if radar.loaded else
+                               'Loaded scan %s from the sweep cache' % scan))
+    else:
         try:
-            radar = pyart.io.read_nexrad_archive(scan_file)
-            logger.info('Loaded scan %s' % scan)
+            radar = read()
+            result["logs"].append((logging.INFO, 'Loaded scan %s' % scan))
         except Exception as ex:
-            logger.error('Exception while loading scan %s - %s' % (scan, str(ex)))
-            array_errors.append(scan)
-            dualpol_errors.append(scan)
+            result["logs"].append((logging.ERROR, 'Exception while loading scan %s - %s' % (scan, str(ex))))
+            result["errors"] = list(render_configs)
+            return result
+        rendered = render_arrays(radar, render_configs, engine, timer, result["logs"])
+    for name, config in render_configs.items():
+        description = DEFAULT_MEMBER_DESCRIPTIONS.get(name, f"{name} npy array")
+        data = rendered[name]
+        if isinstance(data, Exception):
+            result["logs"].append((logging.ERROR, 'Exception while rendering a %s from scan %s - %s' %
+                                   (description, scan, str(data))))
+            result["errors"].append(name)
             continue
+        result["logs"].append((logging.INFO, 'Rendered a %s from scan %s' % (description, scan)))
+        if data.shape != expected_shape(config):
+            result["logs"].append((logging.INFO, f"  Unexpectedly, its shape is {data.shape}."))
+        arrays[name] = data
+        arrays[config_member(name)] = encode_config(config)
+        result["members"].append(name)
+        if pyramid_dims:
+            with timer.stage("pyramid"):
+                for dim, level in pyramid(data, pyramid_dims, pyramid_method).items():
+                    arrays[pyramid_member(name, dim)] = level
 
-        try:
-            data, _, _, y, x = radar2mat(radar, **array_render_config)
-            logger.info('Rendered a npy array from scan %s' % scan)
-            if data.shape != (len(array_render_config["fields"]), len(array_render_config["elevs"]),
-                              array_render_config["dim"], array_render_config["dim"]):
-                logger.info(f"  Unexpectedly, its shape is {data.shape}.")
-            arrays["array"] = data
-        except Exception as ex:
-            logger.error('Exception while rendering a npy array from scan %s - %s' % (scan, str(ex)))
-            array_errors.append(scan)
+    if scan_stats and len(result["members"]) > 0:
+        with timer.stage("stats"):
+            existing = [name for name in stats_configs if name not in render_configs] if append else []
+            scan_arrays = dict(arrays, **load_arrays(npz_path, existing, mmap=True)) if existing else arrays
+            result["stats"] = compute_stats(scan_arrays, stats_configs, scan_stats)
 
-        try:
-            data, _, _, y, x = radar2mat(radar, **dualpol_render_config)
-            logger.info('Rendered a dualpol npy array from scan %s' % scan)
-            if data.shape != (len(dualpol_render_config["fields"]), len(dualpol_render_config["elevs"]),
-                              dualpol_render_config["dim"], dualpol_render_config["dim"]):
-                logger.info(f"  Unexpectedly, its shape is {data.shape}.")
-            arrays["dualpol_array"] = data
-        except Exception as ex:
-            logger.error('Exception while rendering a dualpol npy array from scan %s - %s' % (scan, str(ex)))
-            dualpol_errors.append(scan)
+    fields = {} # for quantized codecs
+    for name, config in render_configs.items():
+        fields[name] = config["fields"]
+        for dim in pyramid_dims or []:
+            fields[pyramid_member(name, dim)] = config["fields"]
+    if len(arrays) > 0:
+        result["save"] = partial(_save_rendered, npz_path, arrays, fields, append, array_codec)
+
+    return result
+
+
+# write the log records of a render_scan result and collect its errors into lists by member;
+# with a journal, the result is also recorded there, which appends its errors to the error logs right away;
+# with a ThroughputLog, its timings are recorded there, and with a wsrdata.scan_stats.StatsCatalog, its statistics
+def record_result(result, logger, errors, journal=None, timing=None, catalog=None):
+    for level, message in result["logs"]:
+        logger.log(level, message)
+    for name in result["errors"]:
+        errors[name].append(result["scan"])
+    if journal is not None:
+        journal.record(result)
+    if timing is not None:
+        timing.record({key: result[key] for key in
+                       ("scan", "seconds", "stages", "bytes_in", "bytes_out", "scan_peak_rss_mb", "members", "errors")
+                       if key in result})
+    if catalog is not None and "stats" in result:
+        catalog.add(result["scan"], result["stats"])
+
+
+# raise ValueError unless every level of pyramid_dims divides the dim of every render config
+def check_pyramid(render_configs, pyramid_dims):
+    for name, config in render_configs.items():
+        if any(config["dim"] % dim for dim in pyramid_dims or []):
+            raise ValueError("pyramid levels %s do not divide dim %d of %s" % (pyramid_dims, config["dim"], name))
+
+
+# the journal of a rendering job in array_dir (see wsrdata.render_journal); with resume=True, scans recorded by
+# an earlier run of the same job are removed from scans and their errors are added to errors
+def open_journal(array_dir, scans, errors, logger, resume, **settings):
+    journal = RenderJournal(array_dir, job_signature(**settings), error_log_name)
+    if resume:
+        completed = journal.completed()
+        for scan in scans:
+            for name in completed.get(scan, {}).get("errors", []):
+                if name in errors:
+                    errors[name].append(scan)
+        logger.info('Resuming: %d of %d scans were already rendered by this job' %
+                    (sum(scan in completed for scan in scans), len(scans)))
+        scans = [scan for scan in scans if scan not in completed]
+    return journal, scans
+
+
+# result of a scan whose rendering raised outside render_scan, or whose worker was killed or died;
+# all members fail, and killed scans get the status "timeout", "memory" or "crashed" in the render journal
+def failed_result(scan, error, render_configs):
+    status = {TaskTimeout: "timeout", MemoryLimitExceeded: "memory", WorkerDied: "crashed"}.get(type(error))
+    return {"scan": scan, "errors": list(render_configs), "status": status, "logs": [(
+        logging.ERROR, 'Exception while rendering scan %s - %s: %s' % (scan, type(error).__name__, str(error)))]}
+
+
+def scan_to_scan_file(scan_dir, scan):
+    station = scan[0:4]
+    year = scan[4:8]
+    month = scan[8:10]
+    date = scan[10:12]
+    return os.path.join(scan_dir, f"{year}/{month}/{date}/{station}/{scan}.gz")
+
+
+def _render_scan_in_worker(scan, scan_dir, array_dir, render_configs, force_rendering, engine, incremental,
+                           array_codec, array_layout, sweep_cache_dir=None, sweep_cache_bytes=None,
+                           pyramid_dims=None, pyramid_method="mean", scan_stats=None, scan_source=None,
+                           defer_save=False, profile=False):
+    sweep_cache = open_cache(sweep_cache_dir, sweep_cache_bytes) if sweep_cache_dir is not None else None
+    if scan_source is None:
+        scan_source = scan_to_scan_file(scan_dir, scan)
+    return render_scan(scan, scan_source, array_dir, render_configs, force_rendering, engine,
+                       incremental, array_codec, array_layout, sweep_cache, pyramid_dims, pyramid_method, scan_stats,
+                       defer_save, profile)
+
+
+class IOOverlap:
+    """Options overlapping reading and writing with rendering when scans are rendered in this process
+
+    Args:
+        prefetch_scans: number of scans read and gunzipped ahead of rendering on a thread, 0 to read each
+            scan when it is rendered
+        write_behind: number of rendered scans whose arrays may wait to be compressed and written on another
+            thread, 0 to write each scan before rendering the next
+    """
+
+    def __init__(self, prefetch_scans=0, write_behind=0):
+        self.prefetch_scans = prefetch_scans
+        self.write_behind = write_behind
+
+
+# yield (item, load(item)) for items, loading up to depth items ahead on a thread
+def _read_ahead(items, load, depth):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        loading = deque()
+        for item in items:
+            loading.append((item, executor.submit(load, item)))
+            if len(loading) > depth:
+                item, future = loading.popleft()
+                yield item, future.result()
+        while loading:
+            item, future = loading.popleft()
+            yield item, future.result()
+
+
+# inputs a txt file where each line is a scan name, e.g.
+# KOKX20130721_093320_V06
+# KTBW20031123_115217
+# num_workers > 1 renders scans in that many processes; results come back to this process in the scan list order,
+# which alone writes rendering.log and the error logs, so they are the same as rendering serially.
+# Each scan is recorded in array_dir/render_journal.jsonl and its errors in the error logs as soon as it is
+# rendered; resume=True skips scans already recorded by an earlier run with the same settings, e.g. after
+# a crash or preemption. npz files are written atomically, so an existing npz is always complete.
+# timing_path optionally names a jsonl file to record the seconds of each stage (check, load, read, each render
+# call, save), bytes read and written and peak RSS while rendering each scan; rolling scans/sec and ETA are then
+# printed every report_every seconds.
+# render_configs optionally replaces array_render_config and dualpol_render_config by any number of
+# named configs, e.g. {"array": ..., "dualpol_array": ..., "array_r300": ...}, each saved as an npz member
+# and rendered from a single read of the scan. All members go to the npz files of array_dir, so this does not
+# produce other ARRAY_VERSIONs in their own directories with "array" and "dualpol_array" members; derive those
+# from the members afterwards, or from an existing version with tools/derive_arrays.py.
+# engine="indexed" renders with cached polar-to-Cartesian index maps (see wsrdata.render_engine) instead of
+# radar2mat; it is experimental, not yet compared with radar2mat on real scans (see
+# tools/compare_render_engines.py), and requires Cartesian nearest-neighbor configs like those of the prepare scripts.
+# incremental=True renders, for scans whose npz already exists, only the members that are missing or were
+# rendered with another config, e.g. adds dualpol arrays to scans that previously failed dualpol rendering.
+# array_codec is the codec of written npz files, e.g. "npy", "shuffle-deflate-1", or the lossy "quant8" which
+# stores fields as 8 bit codes (see wsrdata.array_store for its max error per field);
+# read them with wsrdata.array_store.load_arrays, which handles every codec.
+# array_layout="shard-day" or "shard-month" packs the npz of a station-day or station-month into one shard file
+# instead of writing one file per scan (see ARRAY_LAYOUTS); renderers in several processes append to shards safely.
+# scan_timeout (seconds) and memory_limit_mb kill the worker rendering a scan that exceeds them, so that
+# a few pathological scans do not stall the job; max_scans_per_worker replaces workers after that many scans.
+# With any of them, scans are rendered by a wsrdata.utils.worker_pool.WorkerPool of num_workers processes and
+# recorded in the order they complete. Killed scans fail all members and are listed in killed_scans.log;
+# with quarantine_factor, e.g. 4, they are first retried once, one at a time, with limits that many times larger.
+# schedule="cost" renders scans longest first by their estimated cost, handing them out one at a time to whichever
+# worker is free and recording them in the order they complete, so that workers finish together;
+# costs are gz sizes scaled by seconds per MB by station and format learned from the jsonl timing logs of
+# previous jobs in cost_timing_paths, if any (see wsrdata.render_schedule).
+# sweep_cache_dir caches the polar sweeps rendered from each scan, up to sweep_cache_gb, so that rerendering
+# with other configs does not decode the scans again (see wsrdata.sweep_cache); it requires engine="indexed".
+# overlap, e.g. IOOverlap(prefetch_scans=2, write_behind=2), overlaps reading, rendering and writing when rendering
+# in this process, i.e. num_workers=1 without limits; scans are still recorded in order. By default nothing overlaps.
+# pyramid_dims, e.g. [300, 150], also saves every array downsampled to those sizes as members "<name>@<dim>"
+# pooled by pyramid_method, "mean" or "max" ignoring NaNs, for consumers that need fewer pixels (see render_scan);
+# incremental rendering does not check them, so rerender with force_rendering to add them to existing npz files.
+# scan_stats, e.g. ["mean_dbz", "max_dbz", "nan_fraction", "velocity_coverage", "dualpol"], computes those
+# statistics of each rendered scan (see wsrdata.scan_stats) and appends them to the catalog of array_dir, read with
+# wsrdata.scan_stats.read_catalog; scans whose arrays already exist and are not rendered again get no new row.
+# returns a list of scans failing to render for each config, i.e. (array_errors, dualpol_errors) by default
+def render_by_scan_list(filepath, scan_dir, array_dir,
+                        array_render_config, dualpol_render_config,
+                        force_rendering=False, num_workers=1, chunksize=4, render_configs=None,
+                        engine="radar2mat", incremental=False, array_codec=DEFAULT_CODEC,
+                        array_layout="npz", resume=False, timing_path=None, report_every=30.0,
+                        scan_timeout=None, memory_limit_mb=None, max_scans_per_worker=None, quarantine_factor=None,
+                        schedule="list", cost_timing_paths=None, sweep_cache_dir=None, sweep_cache_gb=50,
+                        overlap=None, pyramid_dims=None, pyramid_method="mean", scan_stats=None):
+
+    log_path = os.path.join(array_dir, "rendering.log")
+        # this includes successful rendering for arrays and dualpol arrays
+    logger = setup_logger(log_path, filepath)
+
+    logger.info('***** Start rendering for %s *****' % (filepath))
+
+    scans = [scan.strip() for scan in open(filepath, "r").readlines()] # Load all scans
+    if render_configs is None:
+        render_configs = default_render_configs(array_render_config, dualpol_render_config)
+    check_pyramid(render_configs, pyramid_dims)
+    check_stats(scan_stats, render_configs)
+    errors = {name: [] for name in render_configs} # to record scans from which rendering fails, by config
+    journal, scans = open_journal(array_dir, scans, errors, logger, resume,
+                                  render_configs=render_configs, force_rendering=force_rendering, engine=engine,
+                                  incremental=incremental, array_codec=array_codec, array_layout=array_layout,
+                                  **({"pyramid": [pyramid_dims, pyramid_method]} if pyramid_dims else {}))
+
+    timing = ThroughputLog(timing_path, len(scans), "Rendered", every=report_every, report=logger.info) \
+        if timing_path else None
+    catalog = StatsCatalog(array_dir) if scan_stats else None
+
+    if schedule == "cost":
+        model = fit_cost_model(read_timings(cost_timing_paths)) if cost_timing_paths else None
+        sizes = scan_file_sizes({scan: scan_to_scan_file(scan_dir, scan) for scan in scans})
+        scans, cost = schedule_by_cost(scans, sizes, model)
+        logger.info('Scheduled %d scans longest first, estimated %s' %
+                    (len(scans), '%.0f seconds of rendering' % cost if model else '%.1f MB of scans' % (cost / 1e6)))
+        chunksize = 1
+    elif schedule != "list":
+        raise ValueError("unknown schedule %s, expected list or cost" % schedule)
+    if sweep_cache_dir is not None and engine != "indexed":
+        raise ValueError("the sweep cache requires engine='indexed'")
+    if overlap is None:
+        overlap = IOOverlap()
+
+    # render arrays from scans
+    render = partial(_render_scan_in_worker, scan_dir=scan_dir, array_dir=array_dir,
+                     render_configs=render_configs, force_rendering=force_rendering, engine=engine,
+                     incremental=incremental, array_codec=array_codec,
+                     array_layout=array_layout, sweep_cache_dir=sweep_cache_dir,
+                     sweep_cache_bytes=int(sweep_cache_gb * 1024 ** 3), pyramid_dims=pyramid_dims,
+                     pyramid_method=pyramid_method, scan_stats=scan_stats, profile=timing is not None)
+    if scan_timeout is not None or memory_limit_mb is not None or max_scans_per_worker is not None:
+        quarantine = [] # killed scans to retry
+        with WorkerPool(render, num_workers, max_scans_per_worker, scan_timeout, memory_limit_mb) as pool:
+            for scan, result in pool.imap_unordered(scans):
+                if isinstance(result, Exception):
+                    if quarantine_factor is not None and isinstance(result, WorkerError):
+                        logger.info('Quarantining scan %s - %s' % (scan, str(result)))
+                        quarantine.append(scan)
+                        continue
+                    result = failed_result(scan, result, render_configs)
+                record_result(result, logger, errors, journal, timing, catalog)
+        if len(quarantine) > 0:
+            logger.info('Retrying %d scans in quarantine' % len(quarantine))
+            with WorkerPool(render, 1, 1, scan_timeout and scan_timeout * quarantine_factor,
+                            memory_limit_mb and memory_limit_mb * quarantine_factor) as pool:
+                for scan, result in pool.imap_unordered(quarantine):
+                    if isinstance(result, Exception):
+                        result = failed_result(scan, result, render_configs)
+                    record_result(result, logger, errors, journal, timing, catalog)
+    elif num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            imap = pool.imap_unordered if schedule == "cost" else pool.imap
+            for result in imap(render, scans, chunksize=chunksize):
+                record_result(result, logger, errors, journal, timing, catalog)
+    else:
+        if overlap.prefetch_scans > 0:
+            def load(scan):
+                scan_file = scan_to_scan_file(scan_dir, scan)
+                if not force_rendering and not incremental and \
+                        array_exists(os.path.join(array_dir, scan_to_array_path(scan, array_layout))):
+                    return scan_file # render_scan skips it without reading it
+                return load_scan(scan_file)
+            sources = _read_ahead(scans, load, overlap.prefetch_scans)
+        else:
+            sources = ((scan, None) for scan in scans)
 
-        if len(arrays) > 0:
-            os.makedirs(os.path.join(array_dir, f"{year}/{month}/{date}/{station}"), exist_ok=True)
-            np.savez_compressed(npz_path, **arrays)
+        def save_and_record(result):
+            record_result(save_result(result), logger, errors, journal, timing, catalog)
 
-    if len(array_errors) > 0:
-        with open(array_error_log_path, 'a+') as f:
-            f.write('\n'.join(array_errors)+'\n')
-    if len(dualpol_errors) > 0:
-        with open(dualpol_error_log_path, 'a+') as f:
-            f.write('\n'.join(dualpol_errors)+'\n')
+        writing = ThreadPoolExecutor(max_workers=1) if overlap.write_behind > 0 else contextlib.nullcontext()
+        with writing as writer:
+            writes = deque()
+            for scan, scan_source in sources:
+                result = render(scan, scan_source=scan_source, defer_save=True)
+                if isinstance(scan_source, bytes):
+                    result["bytes_in"] = os.path.getsize(scan_to_scan_file(scan_dir, scan)) # not gunzipped
+                if writer is None:
+                    save_and_record(result)
+                    continue
+                writes.append(writer.submit(save_and_record, result))
+                while len(writes) > overlap.write_behind or (writes and writes[0].done()):
+                    writes.popleft().result() # raises the exceptions of writing
+            for write in writes:
+                write.result()
+    journal.close()
+    if timing is not None:
+        timing.close()
+    if catalog is not None:
+        catalog.close()
 
     logger.info('***** Finished rendering for file %s *****' % (filepath))
-    return array_errors, dualpol_errors
\ No newline at end of file
+    return tuple(errors.values())
@@ -0,0 +1,87 @@
+"""
+Cost-aware ordering of the scans of a rendering job, so that parallel workers finish together
+instead of a few slow scans at the end of the list holding up the job.
+
+The cost of a scan is estimated from the size of its gz file, scaled by seconds per MB learned from the timing
+logs of previous jobs (see timing_path of render_by_scan_list), by station and scan format, e.g. ("KOKX", "V06")
+for dual-pol scans and ("KTBW", "legacy") for scans without a format suffix. Without timing logs, the estimate
+is the file size itself. Scans are then rendered longest first, handed out one at a time to whichever worker is
+free, which keeps workers busy until the cheapest scans at the end.
+"""
+
+import json
+import os
+import numpy as np
+
+
+def scan_format(scan):
+    """Format suffix of a scan name, e.g. "V06" for KOKX20130721_093320_V06, or "legacy" for KTBW20031123_115217"""
+    parts = scan.split("_")
+    return parts[2] if len(parts) > 2 else "legacy"
+
+
+def read_timings(timing_paths):
+    """Records of jsonl timing logs that rendered a scan, skipping lines truncated by a crash"""
+    records = []
+    for path in timing_paths:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("members") and record.get("bytes_in"):
+                    records.append(record)
+    return records
+
+
+def fit_cost_model(records):
+    """Median seconds per MB of scan file by (station, format), by format, and overall (key None)
+
+    Args:
+        records (list): timing records with "scan", "seconds" and "bytes_in", e.g. from read_timings
+    """
+    rates = {}
+    for record in records:
+        scan = record["scan"]
+        rate = record["seconds"] / (record["bytes_in"] / 1024. / 1024.)
+        for key in ((scan[:4], scan_format(scan)), scan_format(scan), None):
+            rates.setdefault(key, []).append(rate)
+    return {key: float(np.median(values)) for key, values in rates.items()}
+
+
+def estimate_cost(scan, size, model=None):
+    """Estimated seconds to render a scan whose file has size bytes, or the size itself without a model"""
+    if not model:
+        return float(size)
+    for key in ((scan[:4], scan_format(scan)), scan_format(scan), None):
+        if key in model:
+            return model[key] * size / 1024. / 1024.
+    return float(size)
+
+
+def schedule_by_cost(scans, sizes, model=None):
+    """(scans sorted by decreasing estimated cost with ties in list order, total estimated cost)
+
+    Args:
+        scans (list): scan names
+        sizes (dict): scan name -> bytes of its file; missing scans cost 0 since they fail to load right away
+        model (dict): from fit_cost_model, None to order by size
+    """
+    costs = {scan: estimate_cost(scan, sizes.get(scan, 0), model) for scan in scans}
+    return sorted(scans, key=lambda scan: -costs[scan]), sum(costs.values())
+
+
+def scan_file_sizes(scan_files):
+    """Dict from scan names to the bytes of their files, for the files that exist
+
+    Args:
+        scan_files (dict): scan name -> path of its file
+    """
+    sizes = {}
+    for scan, path in scan_files.items():
+        try:
+            sizes[scan] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
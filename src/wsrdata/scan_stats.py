@@ -0,0 +1,185 @@
+"""
+Per-scan statistics computed while rendered arrays are in memory, and a columnar catalog of them per ARRAY_VERSION,
+so that organizing and sampling scans are table lookups rather than reading every npz file again.
+
+Statistics (see STATS) are computed from the rendered members of a scan, i.e. the "array" member of the
+reflectivity, velocity, etc. fields, and "dualpol_array". Each is a fixed-shape value for the render configs of a
+version, e.g. one value per elevation of "array", and NaN where the member it needs failed to render.
+Pixels outside [r_min, r_max] of the Cartesian grid are never rendered and are not counted.
+
+The catalog of an array directory is a set of chunk files ARRAY_DIR/scan_stats/<time>-<pid>-<n>.stats, each
+written by one rendering job with a "scan" column and one column per statistic whose first axis is the scan.
+Chunks are written with wsrdata.array_store like npz files, but named CATALOG_SUFFIX so that tools listing the
+npz files of an array directory do not take them for scans. read_catalog merges them, keeping the latest value
+of each statistic of each scan.
+"""
+
+import glob
+import os
+import time
+import warnings
+import numpy as np
+from wsrdata.array_store import save_arrays, load_arrays
+from wsrdata.render_engine import cartesian_grid
+
+
+CATALOG_DIR = "scan_stats"
+CATALOG_SUFFIX = ".stats" # rather than .npz, which would be listed as the arrays of a scan
+STATS_MEMBER = "array" # member whose fields the statistics describe
+DUALPOL_MEMBER = "dualpol_array"
+
+
+def _planes(arrays, render_configs, field):
+    # (elevations, y, x) planes of a field of STATS_MEMBER, or None if it was not rendered
+    fields = render_configs[STATS_MEMBER]["fields"]
+    if STATS_MEMBER not in arrays or field not in fields:
+        return None
+    return np.asarray(arrays[STATS_MEMBER][fields.index(field)])
+
+
+def _covered(config):
+    # pixels within [r_min, r_max], i.e. those a scan may cover
+    return cartesian_grid(config)[0] != -1
+
+
+def _per_elevation(arrays, render_configs, field, reduce):
+    planes = _planes(arrays, render_configs, field)
+    if planes is None:
+        return np.full(len(render_configs[STATS_MEMBER]["elevs"]), np.nan, dtype=np.float32)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning) # all-NaN planes
+        return np.array([reduce(plane) for plane in planes], dtype=np.float32)
+
+
+def mean_dbz(arrays, render_configs):
+    """Mean reflectivity per elevation with NaN counted as 0, as tools/organize_screened_csv_as_json.py used"""
+    return _per_elevation(arrays, render_configs, "reflectivity", lambda plane: np.mean(np.nan_to_num(plane, nan=0.0)))
+
+
+def max_dbz(arrays, render_configs):
+    """Maximum reflectivity per elevation"""
+    return _per_elevation(arrays, render_configs, "reflectivity", np.nanmax)
+
+
+def velocity_coverage(arrays, render_configs):
+    """Fraction of covered pixels with a valid velocity per elevation"""
+    covered = _covered(render_configs[STATS_MEMBER])
+    return _per_elevation(arrays, render_configs, "velocity",
+                          lambda plane: np.count_nonzero(~np.isnan(plane[covered])) / np.count_nonzero(covered))
+
+
+def nan_fraction(arrays, render_configs):
+    """Fraction of covered pixels without data per field and elevation of STATS_MEMBER"""
+    config = render_configs[STATS_MEMBER]
+    if STATS_MEMBER not in arrays:
+        return np.full((len(config["fields"]), len(config["elevs"])), np.nan, dtype=np.float32)
+    missing = np.isnan(np.asarray(arrays[STATS_MEMBER])[..., _covered(config)])
+    return missing.mean(axis=-1).astype(np.float32)
+
+
+def dualpol(arrays, render_configs):
+    """Whether the scan has a dualpol array"""
+    return np.bool_(DUALPOL_MEMBER in arrays)
+
+
+STATS = {
+    "mean_dbz":             mean_dbz,
+    "max_dbz":              max_dbz,
+    "nan_fraction":         nan_fraction,
+    "velocity_coverage":    velocity_coverage,
+    "dualpol":              dualpol,
+}
+
+
+def check_stats(names, render_configs):
+    """Raise ValueError for names that are not statistics, or if render_configs have no STATS_MEMBER to describe"""
+    unknown = [name for name in names or [] if name not in STATS]
+    if unknown:
+        raise ValueError("unknown scan statistics %s, expected some of %s" % (unknown, list(STATS)))
+    if any(name != "dualpol" for name in names or []) and STATS_MEMBER not in render_configs:
+        raise ValueError("scan statistics %s describe a member %s, which is not rendered" % (names, STATS_MEMBER))
+
+
+def compute_stats(arrays, render_configs, names):
+    """Dict from the names of statistics to their values for the rendered members of a scan
+
+    Args:
+        arrays (dict): member names to rendered arrays, as saved in the npz of the scan
+        render_configs (dict): member names to their render configs
+        names (list of strings): statistics to compute, keys of STATS
+    """
+    return {name: STATS[name](arrays, render_configs) for name in names}
+
+
+class StatsCatalog:
+    """Writer of the statistics of the scans of one job into catalog chunks of an array directory
+
+    Args:
+        array_dir (string): directory of rendered arrays
+        flush_every (int): rows per chunk, so that a crash loses the statistics of at most that many scans
+    """
+
+    def __init__(self, array_dir, flush_every=1000):
+        self.dir = os.path.join(array_dir, CATALOG_DIR)
+        self.prefix = "%s-%d" % (time.strftime("%Y%m%dT%H%M%S", time.gmtime()), os.getpid())
+        self.flush_every = flush_every
+        self._rows = []
+        self._chunks = 0
+
+    def add(self, scan, stats):
+        """Add the row of a scan, a dict as returned by compute_stats"""
+        self._rows.append((scan, stats))
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the rows added since the last flush as a chunk"""
+        if len(self._rows) == 0:
+            return
+        columns = {"scan": np.array([scan for scan, _ in self._rows])}
+        for name in self._rows[0][1]:
+            columns[name] = np.stack([stats[name] for _, stats in self._rows])
+        os.makedirs(self.dir, exist_ok=True)
+        save_arrays(os.path.join(self.dir, "%s-%04d%s" % (self.prefix, self._chunks, CATALOG_SUFFIX)), columns)
+        self._chunks += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def read_catalog(array_dir, columns=None):
+    """Statistics of the scans of an array directory as columns
+
+    Args:
+        array_dir (string): directory of rendered arrays
+        columns (list of strings): statistics to read, default all
+
+    Returns:
+        dict from "scan" and the names of statistics to arrays whose first axis is the scan, sorted by scan;
+        the value of a statistic is its latest one, e.g. of a rerendered scan, and NaN if it was never computed
+    """
+    paths = sorted(glob.glob(os.path.join(array_dir, CATALOG_DIR, "*" + CATALOG_SUFFIX)))
+    chunks = [load_arrays(path) for path in paths]
+    scans = np.unique(np.concatenate([chunk["scan"].astype(str) for chunk in chunks])) if chunks else np.array([], str)
+    rows = [np.searchsorted(scans, chunk["scan"].astype(str)) for chunk in chunks] # row of each scan of a chunk
+
+    catalog = {"scan": scans}
+    if columns is None:
+        columns = sorted(set(name for chunk in chunks for name in chunk if name != "scan"))
+    for name in columns:
+        having = [i for i, chunk in enumerate(chunks) if name in chunk]
+        if len(having) == 0:
+            raise KeyError("no chunk in %s has %s" % (os.path.join(array_dir, CATALOG_DIR), name))
+        computed = np.zeros(len(scans), dtype=bool)
+        for i in having:
+            computed[rows[i]] = True
+        dtype = np.result_type(*[chunks[i][name] for i in having])
+        if not computed.all():
+            dtype = np.result_type(dtype, np.float32) # NaN for scans without it
+        column = np.full((len(scans),) + chunks[having[0]][name].shape[1:], np.nan if dtype.kind in "fc" else 0,
+                         dtype=dtype)
+        for i in having: # later chunks replace earlier ones
+            column[rows[i]] = chunks[i][name]
+        catalog[name] = column
+    return catalog
@@ -0,0 +1,172 @@
+"""
+An on-disk cache of the polar sweeps that the indexed engine renders from, so that rerendering a scan, e.g. with
+FORCE_RENDERING or for a new ARRAY_VERSION with other Cartesian configs, does not decode its Level-II archive again.
+
+An entry holds the sweeps selected by wsrdata.render_engine.extract_sweeps for the fields and elevations of one
+render call, i.e. their data, azimuths, ranges and fixed angles, in one npz file written with
+wsrdata.array_store, e.g. CACHE_DIR/KOKX/KOKX20130721_093320_V06.3f2a9c1e07b4.npz where the suffix hashes
+the fields, elevations and elevation tolerance. Reading an entry refreshes its modification time, and the least
+recently used entries are removed once the cache grows over max_bytes, so the cache can be shared by several
+processes and jobs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from wsrdata.array_store import save_arrays, load_arrays
+from wsrdata.render_engine import check_config, extract_sweeps, render_polar
+
+
+_caches_lock = threading.Lock()
+_caches = {} # (cache_dir, max_bytes) -> SweepCache of this process
+
+
+class SweepCache:
+    """Polar sweeps of scans cached as npz files
+
+    Args:
+        cache_dir (string): directory of the cache
+        max_bytes (int): size of the cache over which least recently used entries are removed
+        codec (string): codec of the npz files, see wsrdata.array_store
+        check_every (int): number of entries written by this process between checks of the cache size
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 ** 3, codec="shuffle-deflate-1", check_every=64):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.check_every = check_every
+        self._written = 0
+
+    def path(self, scan, fields, elevs, elev_tolerance=0.5):
+        key = json.dumps([list(fields), [float(elev) for elev in elevs], float(elev_tolerance)])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, scan[:4], "%s.%s.npz" % (scan, digest))
+
+    def get(self, scan, fields, elevs, elev_tolerance=0.5):
+        """Sweeps as returned by extract_sweeps, or None if they are not cached;
+        raises the ValueError cached by put_error if they could not be extracted"""
+        path = self.path(scan, fields, elevs, elev_tolerance)
+        try:
+            arrays = load_arrays(path)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None # not cached, evicted, or unreadable
+        if "error" in arrays:
+            raise ValueError(str(arrays["error"]))
+        polar = {}
+        for i, (field, elev, elevation) in enumerate(json.loads(str(arrays["sweeps"]))):
+            polar.setdefault(field, {})[elev] = {
+                "azimuth":      arrays["azimuth%d" % i],
+                "range":        arrays["range"],
+                "elevation":    elevation,
+                "data":         arrays["data%d" % i],
+            }
+        return polar
+
+    def put(self, scan, fields, elevs, polar, elev_tolerance=0.5):
+        """Cache sweeps returned by extract_sweeps(radar, fields, elevs, elev_tolerance)"""
+        arrays, sweeps = {}, []
+        for field, field_sweeps in polar.items():
+            for elev, sweep in field_sweeps.items():
+                arrays["azimuth%d" % len(sweeps)] = sweep["azimuth"]
+                arrays["data%d" % len(sweeps)] = sweep["data"]
+                arrays["range"] = sweep["range"]
+                sweeps.append([field, elev, sweep["elevation"]])
+        arrays["sweeps"] = np.array(json.dumps(sweeps))
+        self._save(self.path(scan, fields, elevs, elev_tolerance), arrays)
+
+    def put_error(self, scan, fields, elevs, error, elev_tolerance=0.5):
+        """Cache the ValueError of extract_sweeps, e.g. for a legacy scan without dualpol fields, so that
+        the scan is not read again only to fail again"""
+        self._save(self.path(scan, fields, elevs, elev_tolerance), {"error": np.array(str(error))})
+
+    def _save(self, path, arrays):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_arrays(path, arrays, self.codec)
+        self._written += 1
+        if self._written % self.check_every == 1:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is at most max_bytes"""
+        entries = []
+        for dirpath, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith(".npz"):
+                    try:
+                        stat = os.stat(os.path.join(dirpath, f))
+                    except FileNotFoundError: # removed by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, f)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def open_cache(cache_dir, max_bytes=50 * 1024 ** 3):
+    """The SweepCache of a directory shared by the calls of a process, which keeps count of its writes"""
+    with _caches_lock:
+        if (cache_dir, max_bytes) not in _caches:
+            _caches[(cache_dir, max_bytes)] = SweepCache(cache_dir, max_bytes)
+        return _caches[(cache_dir, max_bytes)]
+
+
+class CachedScan:
+    """A scan whose sweeps are taken from a SweepCache, reading and caching them on a miss; the scan is read
+    at most once, and not at all if all sweeps rendered from it are cached
+
+    Args:
+        cache (SweepCache): sweep cache
+        scan (string): scan name
+        read (function): reads the scan, returning a pyart.core.Radar
+
+    Attributes:
+        loaded (bool): whether the scan was read
+        read_error (Exception): the exception raised reading the scan, if any
+    """
+
+    def __init__(self, cache, scan, read):
+        self.cache = cache
+        self.scan = scan
+        self.read = read
+        self.loaded = False
+        self.read_error = None
+        self._radar = None
+
+    def radar(self):
+        if not self.loaded:
+            self.loaded = True
+            try:
+                self._radar = self.read()
+            except Exception as ex:
+                self.read_error = ex
+        if self.read_error is not None:
+            raise self.read_error
+        return self._radar
+
+    def polar(self, fields, elevs, elev_tolerance=0.5):
+        polar = self.cache.get(self.scan, fields, elevs, elev_tolerance)
+        if polar is None:
+            try:
+                polar = extract_sweeps(self.radar(), fields, elevs, elev_tolerance)
+            except ValueError as ex:
+                if ex is not self.read_error:
+                    self.cache.put_error(self.scan, fields, elevs, ex, elev_tolerance)
+                raise
+            self.cache.put(self.scan, fields, elevs, polar, elev_tolerance)
+        return polar
+
+
+def render_cached(cached_scan, elev_tolerance=0.5, **config):
+    """render_indexed of a CachedScan"""
+    check_config(config)
+    return render_polar(cached_scan.polar(config["fields"], config["elevs"], elev_tolerance), config)
@@ -0,0 +1,152 @@
+"""
+Operations on rendered arrays of shape (fields, elevations, y, x) shared by tools that derive or summarize them.
+"""
+
+import warnings
+import numpy as np
+
+
+def block_pool(array, block, method="mean"):
+    """Pool non-overlapping block x block pixels of the last two axes, ignoring NaNs
+
+    Args:
+        array (np.ndarray): array whose last two axes are y and x, cropped to multiples of block
+        block (int): side of a block in pixels
+        method (string): "mean" or "max"
+
+    Returns:
+        array with the last two axes divided by block; NaN where all pixels of a block are NaN
+    """
+    *lead, height, width = array.shape
+    if height % block or width % block:
+        raise ValueError("array of %d x %d pixels is not a multiple of %d x %d blocks" % (height, width, block, block))
+    blocks = array.reshape(*lead, height // block, block, width // block, block)
+    pool = {"mean": np.nanmean, "max": np.nanmax}[method]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning) # all-NaN blocks
+        return pool(blocks, axis=(-3, -1)).astype(array.dtype, copy=False)
+
+
+def grid_offset(source_r_max, source_dim, target_r_max, target_dim, block=1, tolerance=1e-6):
+    """Index of the first source pixel of a target Cartesian grid, as rendered with x = y =
+    np.linspace(-r_max, r_max, dim), when every block-th source pixel, or the mean of every block x block
+    source pixels, falls on a target pixel
+
+    Args:
+        source_r_max (float): r_max of the source grid
+        source_dim (int): dim of the source grid
+        target_r_max (float): r_max of the target grid
+        target_dim (int): dim of the target grid
+        block (int): stride, or side of the pooled blocks if pooled
+        tolerance (float): fraction of a source pixel by which pixel centers may differ
+
+    Returns:
+        (first pixel for a stride of block, first pixel for block x block pooling), each None if not aligned
+    """
+    if source_dim < 2 or target_dim < 2:
+        return None, None
+    spacing = 2. * source_r_max / (source_dim - 1)
+    if abs(2. * target_r_max / (target_dim - 1) - block * spacing) > tolerance * spacing:
+        return None, None
+
+    def aligned(start, end):
+        index = int(round(start))
+        if abs(start - index) <= tolerance and index >= 0 and index + end <= source_dim:
+            return index
+        return None
+
+    offset = (source_r_max - target_r_max) / spacing # target first center in source pixels
+    strided = aligned(offset, (target_dim - 1) * block + 1)
+    pooled = aligned(offset - (block - 1) / 2., target_dim * block)
+    return strided, pooled
+
+
+def nearest_pixels(source_r_max, source_dim, target_r_max, target_dim):
+    """Indices of the source pixels nearest to the pixels of a target Cartesian grid along one axis, both as
+    rendered with x = y = np.linspace(-r_max, r_max, dim), for grids that are not aligned (see grid_offset)
+
+    Args:
+        source_r_max (float): r_max of the source grid
+        source_dim (int): dim of the source grid
+        target_r_max (float): r_max of the target grid, at most source_r_max
+        target_dim (int): dim of the target grid
+
+    Returns:
+        (np.ndarray of target_dim indices, largest distance in source pixels between the center of a target pixel
+        and the center of its source pixel, at most 0.5)
+    """
+    spacing = 2. * source_r_max / (source_dim - 1)
+    position = (np.linspace(-target_r_max, target_r_max, target_dim) + source_r_max) / spacing # in source pixels
+    indices = np.clip(np.floor(position + 0.5), 0, source_dim - 1).astype(int)
+    return indices, float(np.abs(position - indices).max())
+
+
+def pixel_runs(source_r_max, source_dim, target_r_max, target_dim):
+    """Runs of source pixels nearest to each pixel of a coarser target Cartesian grid along one axis, both as
+    rendered with x = y = np.linspace(-r_max, r_max, dim), for pooling grids that are not aligned with run_pool
+
+    Args:
+        source_r_max (float): r_max of the source grid
+        source_dim (int): dim of the source grid
+        target_r_max (float): r_max of the target grid, at most source_r_max
+        target_dim (int): dim of the target grid
+
+    Returns:
+        (np.ndarray of target_dim + 1 bounds, run i being source pixels bounds[i] to bounds[i + 1] - 1, largest
+        distance in source pixels between the center of a target pixel and the mean center of its run), or
+        (None, None) if some target pixel has no nearest source pixel, i.e. the target grid is finer
+    """
+    source = np.linspace(-source_r_max, source_r_max, source_dim)
+    target_spacing = 2. * target_r_max / (target_dim - 1)
+    nearest = np.floor((source + target_r_max) / target_spacing + 0.5) # target pixel nearest to each source pixel
+    bounds = np.searchsorted(nearest, np.arange(target_dim + 1))
+    lengths = np.diff(bounds)
+    if np.any(lengths == 0):
+        return None, None
+    sums = np.add.reduceat(np.arange(bounds[-1], dtype=float), bounds[:-1])
+    centers = sums / lengths # mean center of each run in source pixels
+    spacing = 2. * source_r_max / (source_dim - 1)
+    position = (np.linspace(-target_r_max, target_r_max, target_dim) + source_r_max) / spacing
+    return bounds, float(np.abs(centers - position).max())
+
+
+def run_pool(array, bounds, method="mean"):
+    """Pool runs of pixels of the last two axes, ignoring NaNs, as block_pool does for runs of equal length
+
+    Args:
+        array (np.ndarray): array whose last two axes are y and x
+        bounds (list of ints): run i of each axis being pixels bounds[i] to bounds[i + 1] - 1, see pixel_runs
+        method (string): "mean" or "max"
+
+    Returns:
+        array with len(bounds) - 1 pixels on the last two axes; NaN where all pixels of a run are NaN
+    """
+    array = array[..., bounds[0]:bounds[-1], bounds[0]:bounds[-1]]
+    starts = np.asarray(bounds[:-1]) - bounds[0]
+    if method == "max":
+        pooled = np.fmax.reduceat(np.fmax.reduceat(array, starts, axis=-1), starts, axis=-2)
+        return pooled.astype(array.dtype, copy=False)
+    if method != "mean":
+        raise KeyError(method)
+    valid = ~np.isnan(array)
+    sums = np.add.reduceat(np.add.reduceat(np.where(valid, array, 0), starts, axis=-1), starts, axis=-2)
+    counts = np.add.reduceat(np.add.reduceat(valid.astype(np.int32), starts, axis=-1), starts, axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"): # all-NaN runs
+        return (sums / counts).astype(array.dtype, copy=False)
+
+
+def pyramid(array, dims, method="mean"):
+    """Downsampled levels of an array, each pooled from the array itself
+
+    Args:
+        array (np.ndarray): array whose last two axes are y and x, of the same size
+        dims (list of ints): sizes of the levels, each dividing the size of the array
+        method (string): "mean" or "max", see block_pool
+
+    Returns:
+        dict from each dim to its level
+    """
+    size = array.shape[-1]
+    if array.shape[-2] != size or any(size % dim for dim in dims):
+        raise ValueError("levels %s do not divide an array of %d x %d pixels" % (dims, array.shape[-2], size))
+    return {dim: block_pool(array, size // dim, method) for dim in dims}
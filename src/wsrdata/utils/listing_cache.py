@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+import os
+import sqlite3
+import threading
+
+
+class ListingCache:
+    """Persistent cache of s3 key listings, stored in a SQLite file
+
+    Each row holds the keys listed under one prefix of one source, i.e. the bucket or directory of a storage
+    backend such as s3://noaa-nexrad-level2, where for get_scans a prefix is one station-day,
+    e.g. 2015/05/02/KMPX/KMPX. Listings of days that may still receive new scans,
+    i.e. today and yesterday in UTC, are not cached.
+    The cache can be shared by threads; concurrent processes are serialized by SQLite.
+    Close it when done, or use it as a context manager.
+
+    Args:
+        path (string): path of the SQLite file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._conn:
+            # listings of caches written before sources were recorded, which may belong to any source
+            self._conn.execute('DROP TABLE IF EXISTS listings')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS source_listings ('
+                               'source TEXT NOT NULL, prefix TEXT NOT NULL, keys TEXT NOT NULL, '
+                               'listed_at TEXT NOT NULL, PRIMARY KEY (source, prefix))')
+
+    def get(self, source, prefix):
+        """Return the cached keys under prefix of source, or None if they have not been cached"""
+        with self._lock:
+            row = self._conn.execute('SELECT keys FROM source_listings WHERE source = ? AND prefix = ?',
+                                     (source, prefix)).fetchone()
+        if row is None:
+            return None
+        return row[0].split('\n') if row[0] else []
+
+    def put(self, source, prefix, keys, day=None):
+        """Cache the keys under prefix of source, unless day (a datetime) is too recent to be complete"""
+        now = datetime.now(timezone.utc)
+        if day is not None and day.date() >= (now - timedelta(days=1)).date():
+            return
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO source_listings VALUES (?, ?, ?, ?)',
+                               (source, prefix, '\n'.join(keys), now.isoformat()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_keys_cached(prefix, list_fn, cache=None, refresh=False, day=None, source=None):
+    """List keys under prefix, going to the network only on a cache miss
+
+    Args:
+        prefix (string): s3 key prefix
+        list_fn (callable): lists keys under a prefix when they are not cached
+        cache (ListingCache): None to always call list_fn
+        refresh (bool): whether to ignore and overwrite the cached listing
+        day (datetime): day of the listing, used to skip caching incomplete days
+        source (string): source that list_fn lists, e.g. the source of its storage backend,
+            required with a cache
+
+    Returns:
+        list of strings: keys in lexicographical order
+    """
+    if cache is not None and source is None:
+        raise ValueError("a listing cache requires the source of the keys")
+    if cache is not None and not refresh:
+        keys = cache.get(source, prefix)
+        if keys is not None:
+            return keys
+
+    keys = list_fn(prefix)
+    if cache is not None:
+        cache.put(source, prefix, keys, day=day)
+    return keys
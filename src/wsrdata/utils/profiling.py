@@ -0,0 +1,155 @@
+"""
+Opt-in instrumentation of the download and render paths: per-scan records of stage timings, sizes and
+peak memory while processing the scan written as json lines to a sidecar file, and rolling throughput with
+an ETA reported as scans complete, to size clusters and spot pathological scans.
+"""
+
+from collections import deque
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+def rss_mb(pid):
+    """Resident set size of a process in MB, None if it is not running"""
+    try:
+        with open("/proc/%d/statm" % pid, "r") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024. / 1024.
+
+
+class RssSampler:
+    """Peak resident set size of this process while processing one scan, sampled on a thread, e.g.
+
+        with RssSampler() as sampler:
+            result = render(scan)
+        sampler.peak_mb  # None where /proc is not available
+
+    Unlike ru_maxrss, the high-water mark of the whole process, the peak of a scan is not hidden by the peaks
+    of earlier scans rendered by the same process.
+
+    Args:
+        interval (float): seconds between samples
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = rss_mb(os.getpid())
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        if self.peak_mb is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._sample()
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class StageTimer:
+    """Wall time per stage of processing one scan, e.g.
+
+        timer = StageTimer()
+        with timer.stage("read"):
+            radar = read_scan(scan_source)
+        timer.seconds  # {"read": 1.3}
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - start
+
+
+class NullTimer:
+    """StageTimer of scans that are not profiled, whose stages record nothing"""
+
+    seconds = None
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+
+class ThroughputLog:
+    """Sidecar of per-scan records with rolling throughput reports
+
+    Args:
+        path (string): jsonl file to append one record per scan to, None to only report throughput
+        total (int): number of scans of the job, for the ETA
+        label (string): verb of the reports, e.g. "Rendered"
+        window (int): number of latest scans the rolling rate is computed over
+        every (float): seconds between reports
+        report (function): called with each report line, default print
+    """
+
+    def __init__(self, path, total, label, window=100, every=30.0, report=print):
+        self.total = total
+        self.label = label
+        self.every = every
+        self.report = report
+        self.done = 0
+        self.start = time.time()
+        self._last_report = self.start
+        self._times = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path is not None else None
+
+    def record(self, record):
+        """Append a record, e.g. {"scan": ..., "stages": {...}, "bytes_in": ...}, and report if due"""
+        now = time.time()
+        with self._lock:
+            self.done += 1
+            self._times.append(now)
+            if self._file is not None:
+                self._file.write(json.dumps(dict(record, time=round(now, 3))) + "\n")
+                self._file.flush()
+            if now - self._last_report >= self.every or self.done == self.total:
+                self._last_report = now
+                self.report(self.summary(now))
+
+    def summary(self, now=None):
+        """Progress line with the rolling and overall scans/sec and the ETA"""
+        now = now or time.time()
+        overall = self.done / max(now - self.start, 1e-9)
+        if len(self._times) > 1:
+            rolling = (len(self._times) - 1) / max(self._times[-1] - self._times[0], 1e-9)
+        else:
+            rolling = overall
+        eta = (self.total - self.done) / rolling if rolling > 0 else float("inf")
+        return "%s %d/%d scans, %.2f scans/sec over the last %d, %.2f scans/sec overall, ETA %s" % (
+            self.label, self.done, self.total, rolling, len(self._times), overall,
+            format_seconds(eta) if eta != float("inf") else "unknown")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
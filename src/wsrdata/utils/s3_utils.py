@@ -1,9 +1,15 @@
-import boto3
 from datetime import datetime, timedelta
+import contextlib
 import errno
 import os
+import random
 import re
 import sys
+import threading
+import time
+import numpy as np
+from wsrdata.utils.listing_cache import ListingCache, list_keys_cached
+from wsrdata.utils.storage_backends import S3Backend
 
 
 ####################################
@@ -87,6 +93,56 @@ def parse_key(key):
     return t, station
 
 
+def parse_key_times(keys):
+    """Parse the timestamps of many keys at once
+
+    Args:
+        keys (list of strings): s3 keys or file names, e.g. 2015/05/02/KMPX/KMPX20150502_021525_V06.gz
+
+    Returns:
+        numpy datetime64[s] array with the timestamp of each key
+    """
+    names = [os.path.basename(key) for key in keys]
+    return np.array(['%s-%s-%sT%s:%s:%s' % (n[4:8], n[8:10], n[10:12], n[13:15], n[15:17], n[17:19])
+                     for n in names], dtype='datetime64[s]')
+
+
+def nearest_time_indices(key_times, times):
+    """Index of the key nearest to each time
+
+    Ties go to the later key, and among keys with the same timestamp to the last one,
+    as when walking the keys forward in time.
+
+    Args:
+        key_times (numpy datetime64 array): timestamps of keys in non-decreasing order
+        times (numpy datetime64 array): query times
+
+    Returns:
+        numpy int array of the same length as times
+    """
+    n = len(key_times)
+    right = np.searchsorted(key_times, times, side='right') # first key after t
+    left = right - 1 # last key at or before t
+    right_c = np.minimum(right, n - 1)
+    left_c = np.maximum(left, 0)
+    # use the later key if it is not farther than the earlier one
+    use_right = (right < n) & ((left < 0) | (key_times[right_c] - times <= times - key_times[left_c]))
+    nearest = np.where(use_right, right_c, left_c)
+    # move to the last of the keys sharing the nearest timestamp
+    return np.searchsorted(key_times, key_times[nearest], side='right') - 1
+
+
+def _nearest_time_indices_sequential(key_times, times):
+    # walk keys forward in time as times increase; only used when keys are not sorted by time
+    indices = np.empty(len(times), dtype=int)
+    i = 0
+    for n, t in enumerate(times):
+        while i + 1 < len(key_times) and not abs(key_times[i] - t) < abs(key_times[i + 1] - t):
+            i = i + 1
+        indices[n] = i
+    return indices
+
+
 def mkdir_p(path):
     try:
         os.makedirs(path)
@@ -105,12 +161,91 @@ def mkdir_p(path):
 # stations = ['KLIX', 'KLCH', 'KLIX']
 stride_in_minutes = 3
 thresh_in_minutes = 3
-bucket = boto3.resource('s3', region_name='us-east-2').Bucket('noaa-nexrad-level2')
-darkecology_bucket = boto3.resource('s3', region_name='us-east-2').Bucket('cajun-batch-test')
+region_name = 'us-east-2'
+bucket_name = 'noaa-nexrad-level2'
+darkecology_bucket_name = 'cajun-batch-test'
+max_pool_connections = 64 # should be at least the number of threads downloading concurrently
+download_retries = 5 # retries after a transient download error, with exponential backoff
+retry_base_delay = 1.0 # seconds before the first retry; doubled for every later retry
+download_chunk_size = 1024 * 1024
+
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+_backend = None
+
+
+def get_s3_client():
+    """Return the S3 client shared by all threads of this process
+
+    The client is created on first use rather than at import time, so importing this module
+    does not start a boto3 session. boto3 clients (unlike resources) are thread-safe, and the
+    shared client keeps a pool of up to max_pool_connections keep-alive connections that
+    concurrent downloads reuse. A forked child process creates its own client.
+
+    Returns:
+        botocore.client.S3
+    """
+    global _s3_client, _s3_client_pid
+
+    if _s3_client is None or _s3_client_pid != os.getpid():
+        with _s3_client_lock:
+            if _s3_client is None or _s3_client_pid != os.getpid():
+                import boto3
+                from botocore.config import Config
+
+                config = Config(max_pool_connections=max_pool_connections,
+                                tcp_keepalive=True)
+                _s3_client = boto3.session.Session().client('s3', region_name=region_name, config=config)
+                _s3_client_pid = os.getpid()
+
+    return _s3_client
+
+
+def list_keys(prefix, bucket=bucket_name):
+    """List all keys under a prefix
+
+    Args:
+        prefix (string): s3 key prefix, e.g. 2015/05/02/KMPX/KMPX
+        bucket (string): bucket name
+
+    Returns:
+        list of strings: keys in lexicographical order
+    """
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o['Key'] for o in page.get('Contents', []))
+    return keys
+
+
+def get_backend():
+    """Return the default storage backend, an S3Backend for bucket_name unless set_backend was called"""
+    global _backend
+
+    if _backend is None:
+        _backend = S3Backend(bucket_name)
+    return _backend
+
+
+def set_backend(backend):
+    """Make get_scans and download_scans use another storage backend by default
+
+    Args:
+        backend: e.g. a storage_backends.LocalBackend for offline benchmarks and tests, or None to restore s3
+    """
+    global _backend
+
+    _backend = backend
 
 
 def get_scans(start_time, end_time, stations, select_by_time=False, time_increment=None, stride_increment=None,
-              thresh_increment=None, with_station=True):
+              thresh_increment=None, with_station=True, listing_cache=None, refresh_listing=False,
+              backend=None):
+    # listing_cache: None, or a ListingCache or the path of its SQLite file, in which s3 listings
+    #   are kept per backend source and station-day so that repeated runs over the same days only list s3 once
+    # refresh_listing: whether to list s3 again and overwrite cached listings
+    # backend: storage backend to list keys from, default get_backend()
     #################
     # First get a list of all keys that are within the desired time period
     # and divide by station 
@@ -127,26 +262,33 @@ def get_scans(start_time, end_time, stations, select_by_time=False, time_increme
     if not thresh_increment:
         thresh_increment = timedelta(minutes=thresh_in_minutes)
 
-    for station in stations:
-        for t in datetime_range(start_time, end_time, time_increment, inclusive=True):
-            # Set filter
-            prefix = s3_prefix(t, station)
-            # print prefix
-
-            start_key = s3_key(start_time, station)
-            end_key = s3_key(end_time, station)
-
-            # Get s3 objects for this day
-            objects = bucket.objects.filter(Prefix=prefix)
+    if backend is None:
+        backend = get_backend()
 
-            # Select keys that fall between our start and end time
-            keys = [o.key for o in objects
-                    if o.key >= start_key
-                    and o.key <= end_key]
-
-            # Add to running lists
-            all_keys.extend(keys)
-            keys_by_station[station].extend(keys)
+    # a cache opened here from its path is closed here too
+    opened = ListingCache(listing_cache) if isinstance(listing_cache, str) else contextlib.nullcontext(listing_cache)
+    with opened as cache:
+        for station in stations:
+            for t in datetime_range(start_time, end_time, time_increment, inclusive=True):
+                # Set filter
+                prefix = s3_prefix(t, station)
+                # print prefix
+
+                start_key = s3_key(start_time, station)
+                end_key = s3_key(end_time, station)
+
+                # Get s3 keys for this day
+                keys = list_keys_cached(prefix, backend.list_keys, cache, refresh_listing, day=t,
+                                        source=backend.source)
+
+                # Select keys that fall between our start and end time
+                keys = [k for k in keys
+                        if k >= start_key
+                        and k <= end_key]
+
+                # Add to running lists
+                all_keys.extend(keys)
+                keys_by_station[station].extend(keys)
     # print(all_keys)
 
     #################
@@ -154,42 +296,156 @@ def get_scans(start_time, end_time, stations, select_by_time=False, time_increme
     #################
     time_thresh = thresh_increment  # timedelta( minutes = thresh_in_minutes )
     times = list(datetime_range(start_time, end_time, stride_increment))
-    current = {s: 0 for s in stations}
+    time_values = np.array(times, dtype='datetime64[us]')
     selected_by_time = {t: set() for t in times}
     # selected_by_station = { s: set() for s in stations }
     selected_keys = []
 
-    for t in times:
-        for station in stations:
-            keys = keys_by_station[station]
-            i = current[station]
-
-            if keys:
-                t_current, _ = parse_key(keys[i])
-
-                while i + 1 < len(keys):
-                    t_next, _ = parse_key(keys[i + 1])
-                    if abs(t_current - t) < abs(t_next - t):
-                        break
-                    t_current = t_next
-                    i = i + 1
-
-                current[station] = i
-                k = keys[i]
-
-                if abs(t_current - t) <= time_thresh:
-                    if select_by_time:
-                        selected_by_time[t].add(k)
-                    # selected_by_station[station].add(k)
-                    if with_station:
-                        selected_keys.append("%s;%s" % (k, station))
-                    else:
-                        selected_keys.append(k)
+    # Parse each station's keys once, match every time to the nearest key of each station,
+    # and keep the matches within the threshold
+    time_positions, station_positions, key_positions = [], [], []
+    for s_pos, station in enumerate(stations):
+        keys = keys_by_station[station]
+        if not keys:
+            continue
+        key_times = parse_key_times(keys).astype('datetime64[us]')
+        if np.all(key_times[1:] >= key_times[:-1]):
+            nearest = nearest_time_indices(key_times, time_values)
+        else:
+            nearest = _nearest_time_indices_sequential(key_times, time_values)
+        within = np.nonzero(np.abs(key_times[nearest] - time_values) <= np.timedelta64(time_thresh))[0]
+        time_positions.append(within)
+        station_positions.append(np.full(len(within), s_pos))
+        key_positions.append(nearest[within])
+
+    if time_positions:
+        time_positions = np.concatenate(time_positions)
+        station_positions = np.concatenate(station_positions)
+        key_positions = np.concatenate(key_positions)
+    # Output by time and then by station
+    for n in np.lexsort((station_positions, time_positions)):
+        t = times[time_positions[n]]
+        station = stations[station_positions[n]]
+        k = keys_by_station[station][key_positions[n]]
+        if select_by_time:
+            selected_by_time[t].add(k)
+        # selected_by_station[station].add(k)
+        if with_station:
+            selected_keys.append("%s;%s" % (k, station))
+        else:
+            selected_keys.append(k)
 
     return selected_keys if not select_by_time else selected_by_time
 
 
-def download_scans(keys, data_dir):
+def is_not_found_error(err):
+    """Whether an exception raised by botocore means that the key does not exist"""
+    from botocore.exceptions import ClientError
+
+    return isinstance(err, ClientError) and err.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound')
+
+
+class IncompleteDownload(IOError):
+    """Raised when the bytes downloaded of an object are fewer or more than its size, e.g. after a dropped
+    connection; retried as a transient error"""
+
+
+def is_transient_error(err):
+    """Whether a failed request is worth retrying
+
+    Throttling, server-side (5xx), connection and read timeout errors of botocore, and IncompleteDownload,
+    are transient; other client errors (e.g. 404 or 403) are not, nor are local file system errors such as
+    a full disk (ENOSPC), a permission error (EACCES) or a missing destination directory (ENOENT).
+    """
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError, IncompleteReadError
+
+    if isinstance(err, ClientError):
+        code = err.response['Error']['Code']
+        status = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or status in (408, 429) or \
+            code in ('SlowDown', 'Throttling', 'RequestTimeout', 'InternalError', 'ServiceUnavailable')
+    return isinstance(err, (ConnectionError, HTTPClientError, IncompleteReadError, IncompleteDownload))
+
+
+def download_file(key, local_file, retries=None, backend=None):
+    """Download one object to local_file, resumably and atomically
+
+    Bytes are written to local_file + '.part', which is renamed to local_file only once its size
+    matches the size (ContentLength) of the object, so local_file never exists in a truncated state.
+    A .part file left by an interrupted run is resumed with a ranged GET.
+    Transient errors are retried with exponential backoff; other errors, including a missing key
+    (a ClientError with code 404), are raised immediately.
+
+    Args:
+        key (string): s3 key
+        local_file (string): destination path
+        retries (int): number of retries after transient errors, default download_retries
+        backend: storage backend to download from, default get_backend()
+    """
+    if retries is None:
+        retries = download_retries
+    if backend is None:
+        backend = get_backend()
+    part_file = local_file + '.part'
+
+    def attempt():
+        size = backend.get_size(key)
+
+        offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        if offset > size: # not a prefix of this object, start over
+            os.remove(part_file)
+            offset = 0
+        if offset < size:
+            with open(part_file, 'ab') as f:
+                for chunk in backend.iter_chunks(key, offset, chunk_size=download_chunk_size):
+                    f.write(chunk)
+
+        downloaded = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        if downloaded != size:
+            raise IncompleteDownload('Downloaded %d bytes of %s, expected %d' % (downloaded, key, size))
+        os.replace(part_file, local_file)
+
+    retry_transient(attempt, retries)
+
+
+def download_bytes(key, retries=None, backend=None):
+    """Download one object into memory, with the same retries and size check as download_file
+
+    Args:
+        key (string): s3 key
+        retries (int): number of retries after transient errors, default download_retries
+        backend: storage backend to download from, default get_backend()
+
+    Returns:
+        bytes
+    """
+    if retries is None:
+        retries = download_retries
+    if backend is None:
+        backend = get_backend()
+
+    def attempt():
+        size = backend.get_size(key)
+        data = b''.join(backend.iter_chunks(key, 0, chunk_size=download_chunk_size))
+        if len(data) != size:
+            raise IncompleteDownload('Downloaded %d bytes of %s, expected %d' % (len(data), key, size))
+        return data
+
+    return retry_transient(attempt, retries)
+
+
+def retry_transient(fn, retries):
+    """Call fn, retrying it with exponential backoff while it raises transient errors"""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as err:
+            if attempt == retries or not is_transient_error(err):
+                raise
+            time.sleep(retry_base_delay * 2 ** attempt * (1 + random.random()))
+
+
+def download_scans(keys, data_dir, verify_existing=False, backend=None):
     #################
     # Download files into hierarchy
     #################
@@ -199,6 +455,12 @@ def download_scans(keys, data_dir):
         local_path, filename = os.path.split(local_file)
         mkdir_p(local_path)
 
+        # Files left by runs that did not download atomically may be truncated;
+        # with verify_existing, redownload those whose size does not match s3
+        if verify_existing and os.path.isfile(local_file):
+            if os.path.getsize(local_file) != (backend or get_backend()).get_size(key):
+                os.remove(local_file)
+
         # Download file if we don't already have it
         if not os.path.isfile(local_file):
-            bucket.download_file(key, local_file)
+            download_file(key, local_file, backend=backend)
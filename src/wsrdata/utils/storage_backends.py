@@ -0,0 +1,122 @@
+"""
+Storage backends that s3_utils lists and downloads scans from.
+A backend implements list_keys(prefix), get_size(key) and iter_chunks(key, offset, chunk_size),
+names what it reads in its source, e.g. s3://noaa-nexrad-level2, so that listings of different
+backends are cached apart (see wsrdata.utils.listing_cache),
+and reports errors the way botocore does, i.e. a missing key is a ClientError with code 404,
+so that callers handle both backends alike.
+"""
+
+import os
+import random
+import threading
+import time
+
+
+class S3Backend:
+    """Objects in an s3 bucket, read through the shared client of s3_utils
+
+    Args:
+        bucket (string): bucket name, default s3_utils.bucket_name
+    """
+
+    def __init__(self, bucket=None):
+        from wsrdata.utils import s3_utils
+        self._s3_utils = s3_utils
+        self.bucket = bucket or s3_utils.bucket_name
+        self.source = 's3://' + self.bucket
+
+    def list_keys(self, prefix):
+        return self._s3_utils.list_keys(prefix, bucket=self.bucket)
+
+    def get_size(self, key):
+        return self._s3_utils.get_s3_client().head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def iter_chunks(self, key, offset=0, chunk_size=1024 * 1024):
+        request = {'Bucket': self.bucket, 'Key': key}
+        if offset > 0:
+            request['Range'] = 'bytes=%d-' % offset
+        body = self._s3_utils.get_s3_client().get_object(**request)['Body']
+        return body.iter_chunks(chunk_size=chunk_size)
+
+
+class LocalBackend:
+    """Files in a local directory that mirrors the s3 key layout, e.g. root/2015/05/02/KMPX/KMPX20150502_021525_V06.gz
+
+    Stands in for s3 to benchmark and test downloading offline.
+    Every request (list, size, read) can be delayed by latency seconds, reads can be throttled to
+    throughput bytes per second per stream, and requests can fail at random with error_rate,
+    raising the same transient error as s3 throttling. A fraction truncate_rate of reads stops
+    early, like a dropped connection.
+
+    Args:
+        root (string): directory mirroring the bucket
+        latency (float): seconds added to each request
+        throughput (float): bytes per second per read, None for unthrottled
+        error_rate (float): probability that a request fails with a transient error
+        truncate_rate (float): probability that a read stops halfway
+        seed (int): seed for the random errors
+    """
+
+    def __init__(self, root, latency=0.0, throughput=None, error_rate=0.0, truncate_rate=0.0, seed=None):
+        self.root = root
+        self.source = 'file://' + os.path.abspath(root)
+        self.latency = latency
+        self.throughput = throughput
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random()
+
+    def _request(self, operation, key):
+        # simulate latency, injected failures and missing keys of one request
+        from botocore.exceptions import ClientError
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._draw() < self.error_rate:
+            raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Injected error for %s' % key},
+                               'ResponseMetadata': {'HTTPStatusCode': 503}}, operation)
+        if key is not None and not os.path.isfile(os.path.join(self.root, key)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'},
+                               'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+
+    def list_keys(self, prefix):
+        self._request('ListObjectsV2', None)
+        directory = os.path.join(self.root, prefix.rsplit('/', 1)[0]) if '/' in prefix else self.root
+        keys = []
+        for dirpath, _, filenames in os.walk(directory):
+            relpath = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for filename in filenames:
+                key = filename if relpath == '.' else '%s/%s' % (relpath, filename)
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def get_size(self, key):
+        self._request('HeadObject', key)
+        return os.path.getsize(os.path.join(self.root, key))
+
+    def iter_chunks(self, key, offset=0, chunk_size=1024 * 1024):
+        self._request('GetObject', key)
+        path = os.path.join(self.root, key)
+        end = os.path.getsize(path)
+        if self.truncate_rate and self._draw() < self.truncate_rate:
+            end = offset + (end - offset) // 2
+        return self._read(path, offset, end, chunk_size)
+
+    def _read(self, path, offset, end, chunk_size):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < end:
+                chunk = f.read(min(chunk_size, end - offset))
+                if not chunk:
+                    break
+                offset += len(chunk)
+                if self.throughput:
+                    time.sleep(len(chunk) / self.throughput)
+                yield chunk
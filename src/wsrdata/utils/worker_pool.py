@@ -0,0 +1,168 @@
+"""
+A process pool that enforces per-task wall time and memory limits, for tasks like rendering a scan
+that occasionally spin for minutes or blow up memory on a pathological input.
+
+Each worker process runs one task at a time. A task exceeding its limits has its worker killed and
+replaced, and is reported with an exception of its own class instead of a result, so that a handful of bad
+inputs neither stall the pool nor take down the job. Workers are also recycled after max_tasks_per_child tasks
+to return memory leaked by long runs. Memory limits are enforced on the resident set size read from /proc,
+so they are only available on linux.
+"""
+
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import time
+from wsrdata.utils.profiling import rss_mb
+
+
+class WorkerError(Exception):
+    """A task that did not return because its worker was killed or died"""
+
+
+class TaskTimeout(WorkerError):
+    """A task that ran longer than the timeout of the pool"""
+
+
+class MemoryLimitExceeded(WorkerError):
+    """A task whose worker grew larger than the memory limit of the pool"""
+
+
+class WorkerDied(WorkerError):
+    """A task whose worker exited without returning, e.g. killed by the kernel out-of-memory killer"""
+
+
+def _worker_loop(func, conn):
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        try:
+            message = ("ok", func(task[0]))
+        except Exception as ex:
+            message = ("error", ex)
+        try:
+            conn.send(message)
+        except Exception: # e.g. an unpicklable result or exception
+            conn.send(("error", RuntimeError(repr(message[1]))))
+
+
+class _Worker:
+
+    def __init__(self, context, func):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(func, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.busy = False
+        self.item = None
+        self.started = None
+        self.done = 0
+
+    def submit(self, item):
+        self.conn.send((item,))
+        self.busy = True
+        self.item = item
+        self.started = time.time()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """Pool of processes calling func on items, with per-task limits
+
+    Args:
+        func (function): picklable function of one item, e.g. a functools.partial of a module-level function
+        num_workers (int): number of worker processes
+        max_tasks_per_child (int): number of tasks after which a worker is replaced, None to never replace
+        timeout (float): seconds a task may run before its worker is killed, None for no limit
+        memory_limit_mb (float): resident set size in MB a worker may grow to before it is killed,
+            None for no limit
+        poll_interval (float): seconds between checks of the memory of workers
+    """
+
+    def __init__(self, func, num_workers=1, max_tasks_per_child=None, timeout=None, memory_limit_mb=None,
+                 poll_interval=1.0):
+        if memory_limit_mb is not None and rss_mb(os.getpid()) is None:
+            raise ValueError("memory limits require /proc, which is not available on this platform")
+        self.func = func
+        self.num_workers = num_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.poll_interval = poll_interval
+        self._context = multiprocessing.get_context()
+        self._workers = []
+
+    def imap_unordered(self, items):
+        """Yield (item, result) for each item in the order they complete, where result is the return value of
+        func, the exception it raised, or a WorkerError if its worker was killed or died"""
+        pending = deque(items)
+        while len(self._workers) < min(self.num_workers, len(pending)):
+            self._workers.append(_Worker(self._context, self.func))
+
+        while True:
+            for worker in self._workers:
+                if not worker.busy and pending:
+                    worker.submit(pending.popleft())
+            busy = [worker for worker in self._workers if worker.busy]
+            if not busy:
+                return
+
+            wait_time = self.poll_interval if self.memory_limit_mb is not None else None
+            if self.timeout is not None:
+                deadline = min(worker.started for worker in busy) + self.timeout
+                wait_time = max(0.0, min(wait_time or float("inf"), deadline - time.time()))
+            ready = wait([worker.conn for worker in busy], timeout=wait_time)
+
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        _, value = worker.conn.recv()
+                    except (EOFError, OSError):
+                        yield self._replace(worker, WorkerDied(
+                            "worker exited with code %s" % worker.process.exitcode))
+                        continue
+                    worker.busy = False
+                    worker.done += 1
+                    if self.max_tasks_per_child is not None and worker.done >= self.max_tasks_per_child:
+                        worker.stop()
+                        self._workers[self._workers.index(worker)] = _Worker(self._context, self.func)
+                    yield worker.item, value
+                elif self.timeout is not None and time.time() - worker.started >= self.timeout:
+                    yield self._replace(worker, TaskTimeout("no result after %g seconds" % self.timeout))
+                elif self.memory_limit_mb is not None:
+                    rss = rss_mb(worker.process.pid)
+                    if rss is not None and rss > self.memory_limit_mb:
+                        yield self._replace(worker, MemoryLimitExceeded(
+                            "worker grew to %.0f MB, over the limit of %.0f MB" % (rss, self.memory_limit_mb)))
+
+    def _replace(self, worker, error):
+        # kill a worker and start another one in its place; returns (item, error) of its task
+        worker.kill()
+        self._workers[self._workers.index(worker)] = _Worker(self._context, self.func)
+        return worker.item, error
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,93 @@
+"""
+Validating the array files of an ARRAY_VERSION without decompressing their arrays.
+
+check_file reads only the zip central directory, the local headers and the .npy headers of one npz file, or of
+one scan in a shard, so checking a version of many scans is bound by file system metadata rather than by
+inflating arrays. Problems are reported as (kind, message) pairs, where kind is one of
+    "unreadable"    the file is not a readable zip archive, e.g. it was cut short and lost its central
+                    directory, or a member header cannot be parsed
+    "truncated"     the data of a member does not fit in the archive, or a shard is shorter than its index
+    "missing"       an expected member is absent
+    "shape"         a member's shape differs from the one its render config renders
+    "dtype"         a member's dtype differs from the expected one
+
+Expected members and shapes are those of the render configs of a version as recorded in
+static/arrays/previous_versions.json, i.e. {"array": config, "dualpol": config} whose npz members are
+wsrdata.derive_arrays.DERIVED_MEMBERS; pyramid levels "<member>@<dim>" are checked against their member.
+"""
+
+import os
+import zipfile
+from wsrdata import array_shards
+from wsrdata.array_store import read_headers, truncated_members, PYRAMID_SEPARATOR
+from wsrdata.derive_arrays import DERIVED_MEMBERS
+
+
+def member_shapes(version_configs):
+    """Dict from npz members to the shapes rendered by the configs of a version"""
+    return {DERIVED_MEMBERS[name]: (len(config["fields"]), len(config["elevs"]), config["dim"], config["dim"])
+            for name, config in version_configs.items() if config is not None}
+
+
+def list_array_paths(array_dir):
+    """Paths of the npz files under a directory, and array paths "<shard>#<key>" of the scans in its shards"""
+    paths = []
+    for dirpath, dirs, files in os.walk(array_dir):
+        dirs.sort()
+        for f in sorted(files):
+            path = os.path.join(dirpath, f)
+            if f.endswith(".npz"):
+                paths.append(path)
+            elif f.endswith(".shard"):
+                paths.extend(path + array_shards.SEPARATOR + key for key in array_shards.read_index(path))
+    return paths
+
+
+def path_to_scan(path):
+    """Scan name of an npz path, or the key of an array path in a shard"""
+    if array_shards.is_shard_path(path):
+        return array_shards.split_shard_path(path)[1]
+    return os.path.basename(path)[:-len(".npz")]
+
+
+def check_file(path, shapes, dtype=None, excused=()):
+    """Problems of one array file found from its headers only
+
+    Args:
+        path (string): npz file, or "<shard>#<key>"
+        shapes (dict): expected members to their shapes, see member_shapes
+        dtype (string): expected dtype of the members, or None not to check dtypes
+        excused (collection): expected members that are known to be missing, e.g. from an error log
+
+    Returns:
+        (dict from member names to (shape, dtype string), list of (kind, message)); the dict is empty if the
+        file is unreadable
+    """
+    problems = []
+    if array_shards.is_shard_path(path):
+        shard, key = array_shards.split_shard_path(path)
+        offset, length = array_shards.read_index(shard)[key]
+        if offset + length > os.path.getsize(shard):
+            return {}, [("truncated", "shard %s ends before the blob of %s" % (shard, key))]
+    try:
+        for member in truncated_members(path):
+            problems.append(("truncated", "member %s is cut short" % member))
+        headers = {name: (tuple(shape), str(member_dtype))
+                   for name, (shape, member_dtype) in read_headers(path).items() if not name.endswith(".config")}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as ex:
+        return {}, [("unreadable", str(ex) or type(ex).__name__)]
+
+    for member, shape in shapes.items():
+        if member not in headers:
+            if member not in excused:
+                problems.append(("missing", "no %s" % member))
+            continue
+        if headers[member][0] != tuple(shape):
+            problems.append(("shape", "%s has shape %s rather than %s" % (member, headers[member][0], tuple(shape))))
+    for name, (shape, member_dtype) in headers.items():
+        member, _, dim = name.partition(PYRAMID_SEPARATOR)
+        if dim and member in headers and shape != headers[member][0][:-2] + (int(dim), int(dim)):
+            problems.append(("shape", "%s has shape %s for %s of shape %s" % (name, shape, member, headers[member][0])))
+        if dtype is not None and member in shapes and member_dtype != dtype:
+            problems.append(("dtype", "%s has dtype %s rather than %s" % (name, member_dtype, dtype)))
+    return headers, problems
@@ -0,0 +1,31 @@
+import os
+from wsrdata import array_shards
+
+
+def test_index_line_torn_in_its_length_is_ignored(tmp_path):
+    shard = str(tmp_path / "KOKX.shard")
+    array_shards.append_blob(shard + "#A", b"a" * 100)
+    array_shards.append_blob(shard + "#B", b"b" * 12345)
+    index_path = shard + array_shards.INDEX_SUFFIX
+    with open(index_path, "rb") as f:
+        lines = f.read().split(b"\n")
+    assert lines[1].endswith(b" 12345")
+    with open(index_path, "r+b") as f: # a crash while writing the line of B, in the middle of its length
+        f.truncate(len(lines[0]) + 1 + len(lines[1]) - 3)
+
+    array_shards.append_blob(shard + "#C", b"c" * 10) # ends the torn line before its own
+    index = array_shards.read_index(shard)
+    assert "B" not in index
+    assert array_shards.read_blob(shard + "#A") == b"a" * 100
+    assert array_shards.read_blob(shard + "#C") == b"c" * 10
+    assert index["C"] == (100 + 12345, 10)
+    assert os.path.getsize(shard) == 100 + 12345 + 10
+
+
+def test_index_lines_without_a_crc_are_read_within_the_shard(tmp_path):
+    shard = str(tmp_path / "KOKX.shard")
+    with open(shard, "wb") as f:
+        f.write(b"a" * 100)
+    with open(shard + array_shards.INDEX_SUFFIX, "wb") as f:
+        f.write(b"A 0 100\nB 100 50\n") # B is beyond the end of the shard
+    assert array_shards.read_index(shard) == {"A": (0, 100)}
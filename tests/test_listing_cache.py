@@ -0,0 +1,30 @@
+from datetime import datetime
+from wsrdata.utils import s3_utils
+from wsrdata.utils.listing_cache import ListingCache
+from wsrdata.utils.storage_backends import LocalBackend
+
+
+DAY = datetime(2015, 5, 2)
+
+
+def mirror(root, scans):
+    for scan in scans:
+        path = root / "2015" / "05" / "02" / "KMPX" / (scan + ".gz")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"scan")
+    return LocalBackend(str(root))
+
+
+def test_listings_of_backends_are_cached_apart(tmp_path):
+    first = mirror(tmp_path / "first", ["KMPX20150502_021525_V06"])
+    second = mirror(tmp_path / "second", ["KMPX20150502_023012_V06"])
+    cache_path = str(tmp_path / "listings.sqlite")
+
+    for backend in [first, second, first]:
+        keys = s3_utils.get_scans(DAY, datetime(2015, 5, 2, 23, 59), ["KMPX"], with_station=False,
+                                  listing_cache=cache_path, backend=backend)
+        assert sorted(set(keys)) == backend.list_keys("2015/05/02/KMPX/KMPX")
+
+    with ListingCache(cache_path) as cache:
+        assert cache.get(first.source, "2015/05/02/KMPX/KMPX") == ["2015/05/02/KMPX/KMPX20150502_021525_V06.gz"]
+        assert cache.get(second.source, "2015/05/02/KMPX/KMPX") == ["2015/05/02/KMPX/KMPX20150502_023012_V06.gz"]
@@ -0,0 +1,36 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("wsrlib")
+
+from wsrdata.array_store import save_arrays
+from wsrdata.render_npy_arrays import members_to_render, render_scan, scan_to_array_path
+
+
+SCAN = "KOKX20130721_093320_V06"
+CONFIG = {"ydirection": "xy", "fields": ["reflectivity"], "coords": "cartesian", "r_min": 2125.0, "r_max": 150000.0,
+          "r_res": 250, "az_res": 0.5, "dim": 8, "sweeps": None, "elevs": [0.5], "use_ground_range": True,
+          "interp_method": "nearest"}
+RENDER_CONFIGS = {"array": CONFIG, "dualpol_array": dict(CONFIG, fields=["differential_reflectivity"])}
+
+
+def truncated_npz(array_dir):
+    path = os.path.join(array_dir, scan_to_array_path(SCAN))
+    os.makedirs(os.path.dirname(path))
+    save_arrays(path, {name: np.zeros((1, 1, 8, 8), dtype=np.float32) for name in RENDER_CONFIGS})
+    with open(path, "r+b") as f: # as left by a crash of a run that did not write npz files atomically
+        f.truncate(os.path.getsize(path) // 2)
+    return path
+
+
+def test_truncated_npz_is_stale(tmp_path):
+    path = truncated_npz(str(tmp_path))
+    assert members_to_render(path, RENDER_CONFIGS) == ([], ["array", "dualpol_array"])
+
+
+def test_incremental_rendering_survives_a_truncated_npz(tmp_path):
+    truncated_npz(str(tmp_path))
+    result = render_scan(SCAN, str(tmp_path / "missing.gz"), str(tmp_path), RENDER_CONFIGS, incremental=True)
+    # every member is rendered again, or fails with the scan, rather than the truncated npz failing the job
+    assert sorted(result["members"] + result["errors"]) == ["array", "dualpol_array"]
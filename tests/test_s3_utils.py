@@ -0,0 +1,38 @@
+import errno
+import os
+import pytest
+from wsrdata.utils import s3_utils
+from wsrdata.utils.storage_backends import LocalBackend
+
+
+KEY = "2015/05/02/KMPX/KMPX20150502_021525_V06.gz"
+
+
+@pytest.fixture
+def backend(tmp_path):
+    path = tmp_path / "bucket" / KEY
+    path.parent.mkdir(parents=True)
+    path.write_bytes(os.urandom(4096))
+    return LocalBackend(str(tmp_path / "bucket"))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(s3_utils.time, "sleep", slept.append)
+    return slept
+
+
+def test_local_errors_are_raised_without_retries(backend, sleeps, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        s3_utils.download_file(KEY, str(tmp_path / "missing_dir" / "scan.gz"), retries=5, backend=backend)
+    assert sleeps == []
+    assert not s3_utils.is_transient_error(OSError(errno.ENOSPC, "No space left on device"))
+    assert not s3_utils.is_transient_error(PermissionError(errno.EACCES, "Permission denied"))
+
+
+def test_incomplete_downloads_are_retried(backend, sleeps, tmp_path):
+    backend.truncate_rate = 1.0 # every read stops halfway
+    with pytest.raises(s3_utils.IncompleteDownload):
+        s3_utils.download_bytes(KEY, retries=2, backend=backend)
+    assert len(sleeps) == 2
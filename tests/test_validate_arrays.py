@@ -0,0 +1,23 @@
+import os
+import numpy as np
+from wsrdata.array_store import save_arrays
+from wsrdata.scan_stats import StatsCatalog, read_catalog
+from wsrdata.validate_arrays import list_array_paths, check_file
+
+
+SHAPES = {"array": (3, 5, 8, 8), "dualpol_array": (3, 5, 8, 8)}
+
+
+def test_catalog_chunks_are_not_validated_as_scans(tmp_path):
+    array_dir = str(tmp_path)
+    scan_path = os.path.join(array_dir, "2013", "07", "21", "KOKX", "KOKX20130721_093320_V06.npz")
+    os.makedirs(os.path.dirname(scan_path))
+    save_arrays(scan_path, {name: np.zeros(shape, dtype=np.float32) for name, shape in SHAPES.items()})
+    catalog = StatsCatalog(array_dir)
+    catalog.add("KOKX20130721_093320_V06", {"dualpol": np.bool_(True)})
+    catalog.close()
+
+    paths = list_array_paths(array_dir)
+    assert paths == [scan_path]
+    assert all(check_file(path, SHAPES)[1] == [] for path in paths)
+    assert list(read_catalog(array_dir)["scan"]) == ["KOKX20130721_093320_V06"]
@@ -0,0 +1,85 @@
+"""
+This script benchmarks the array codecs of wsrdata.array_store on real rendered arrays.
+It samples npz files from an array directory, e.g. ARRAY_DIR/2013/07/21/KOKX/KOKX20130721_093320_V06.npz,
+rewrites their arrays with each codec into a temporary directory and reads them back, and prints
+the bytes on disk, the compression ratio, write and read throughput in MB/sec of uncompressed arrays,
+and the time to read one (field, elevation) plane of each array with load_arrays(..., mmap=True).
+Read arrays are checked to equal the originals, NaNs included, except for lossy quantized codecs, for which
+the max absolute error of each field is printed instead. Fields are taken from the "<member>.config" members.
+Use the results to pick ARRAY_CODEC for an ARRAY_VERSION in the prepare scripts.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from wsrdata.array_store import save_arrays, load_arrays, parse_codec
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--array_dir", type=str, required=True, help="directory of rendered npz files")
+parser.add_argument("--num_files", type=int, default=50, help="number of npz files to sample")
+parser.add_argument("--codecs", type=str, nargs="+",
+                    default=["npz", "npy", "deflate-1", "deflate-6", "deflate-9",
+                             "shuffle-deflate-1", "shuffle-deflate-6", "shuffle-deflate-9",
+                             "quant8", "quant8-1", "quant16", "quant16-1"],
+                    help="codecs to compare")
+parser.add_argument("--repeats", type=int, default=3, help="timings are the best of this many runs")
+args = parser.parse_args()
+
+npz_paths = sorted(os.path.join(dirpath, f) for dirpath, _, files in os.walk(args.array_dir)
+                   for f in files if f.endswith(".npz"))
+random.Random(0).shuffle(npz_paths)
+samples = [load_arrays(path) for path in npz_paths[:args.num_files]]
+fields = [{name[:-len(".config")]: json.loads(str(array))["fields"]
+           for name, array in arrays.items() if name.endswith(".config")} for arrays in samples]
+raw_bytes = sum(array.nbytes for arrays in samples for array in arrays.values())
+print(f"{len(samples)} files, {raw_bytes / 1e6:.1f} MB of arrays")
+
+for codec in args.codecs:
+    out_dir = tempfile.mkdtemp(prefix="wsrdata_codecs_")
+    try:
+        paths = [os.path.join(out_dir, f"{i}.npz") for i in range(len(samples))]
+        write_time = read_time = plane_time = float("inf")
+        for _ in range(args.repeats):
+            start = time.time()
+            for path, arrays, sample_fields in zip(paths, samples, fields):
+                save_arrays(path, arrays, codec, sample_fields)
+            write_time = min(write_time, time.time() - start)
+
+            start = time.time()
+            loaded = [load_arrays(path) for path in paths]
+            read_time = min(read_time, time.time() - start)
+
+            start = time.time()
+            for path, arrays in zip(paths, samples):
+                for name in arrays:
+                    if arrays[name].ndim >= 3:
+                        np.array(load_arrays(path, [name], mmap=True)[name][(0,) * (arrays[name].ndim - 2)])
+            plane_time = min(plane_time, time.time() - start)
+
+        lossy = parse_codec(codec)[0] in ("quant8", "quant16")
+        max_errors = {} # field -> max absolute error
+        for arrays, read, sample_fields in zip(samples, loaded, fields):
+            assert arrays.keys() == read.keys(), f"{codec} changed the members"
+            for name in arrays:
+                if lossy and arrays[name].dtype.kind == "f":
+                    assert np.array_equal(np.isnan(arrays[name]), np.isnan(read[name])), f"{codec} changed NaNs"
+                    names = sample_fields.get(name, [f"{name}[{i}]" for i in range(len(arrays[name]))])
+                    for i, field in enumerate(names):
+                        error = np.nanmax(np.abs(arrays[name][i] - read[name][i]), initial=0.0)
+                        max_errors[field] = max(max_errors.get(field, 0.0), float(error))
+                else:
+                    assert np.array_equal(arrays[name], read[name], equal_nan=arrays[name].dtype.kind in "fc"), \
+                        f"{codec} changed {name}"
+        n_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"{codec:>20s}: {n_bytes / 1e6:9.1f} MB, ratio {raw_bytes / n_bytes:5.2f}, "
+              f"write {raw_bytes / write_time / 1e6:8.1f} MB/sec, read {raw_bytes / read_time / 1e6:8.1f} MB/sec, "
+              f"one plane {plane_time / len(paths) * 1e3:7.2f} ms/file")
+        for field, error in max_errors.items():
+            print(f"{'':>22s}max error of {field}: {error:.6g}")
+    finally:
+        shutil.rmtree(out_dir)
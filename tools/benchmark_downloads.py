@@ -0,0 +1,59 @@
+"""
+This script benchmarks download_by_scan_list offline against a local directory that mirrors the s3 layout,
+e.g. MIRROR_DIR/2013/07/21/KOKX/KOKX20130721_093320_V06.gz, with optional injected latency, throughput limit,
+and errors. Use --fill_mirror to create random files of --scan_size bytes for scans missing from the mirror.
+For each number of workers, scans are downloaded into a fresh temporary directory and
+scans/sec, MB/sec, and not-in-s3 / error counts are printed.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from wsrdata.download_radar_scans import download_by_scan_list, scan_to_aws_key
+from wsrdata.utils.storage_backends import LocalBackend
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--scan_list", type=str, required=True, help="txt file where each line is a scan name")
+parser.add_argument("--mirror_dir", type=str, required=True, help="local directory mirroring the s3 bucket")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16, 64], help="numbers of workers to compare")
+parser.add_argument("--latency", type=float, default=0.05, help="seconds added to each request")
+parser.add_argument("--throughput", type=float, default=None, help="bytes/sec per stream, default unthrottled")
+parser.add_argument("--error_rate", type=float, default=0.0, help="probability of a transient error per request")
+parser.add_argument("--truncate_rate", type=float, default=0.0, help="probability that a read stops halfway")
+parser.add_argument("--fill_mirror", action="store_true", help="create random files for scans missing in the mirror")
+parser.add_argument("--scan_size", type=int, default=8 * 1024 * 1024, help="bytes of each created file")
+args = parser.parse_args()
+
+scans = [scan.strip() for scan in open(args.scan_list, "r").readlines() if scan.strip()]
+if args.fill_mirror:
+    for scan in scans:
+        path = os.path.join(args.mirror_dir, scan_to_aws_key('%s.gz' % scan))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(os.urandom(args.scan_size))
+
+backend = LocalBackend(args.mirror_dir, latency=args.latency, throughput=args.throughput,
+                       error_rate=args.error_rate, truncate_rate=args.truncate_rate, seed=0)
+
+for max_workers in args.workers:
+    out_dir = tempfile.mkdtemp(prefix="wsrdata_benchmark_")
+    try:
+        start = time.time()
+        errors = download_by_scan_list(
+            args.scan_list, os.path.join(out_dir, "scans"),
+            os.path.join(out_dir, "download.log"),
+            os.path.join(out_dir, "not_s3.log"),
+            os.path.join(out_dir, "error_scans.log"),
+            max_workers=max_workers, backend=backend,
+        )
+        elapsed = time.time() - start
+        n_bytes = sum(os.path.getsize(os.path.join(dirpath, f))
+                      for dirpath, _, files in os.walk(os.path.join(out_dir, "scans")) for f in files)
+        print(f"workers {max_workers:4d}: {len(scans) / elapsed:8.2f} scans/sec, "
+              f"{n_bytes / elapsed / 1e6:8.2f} MB/sec, "
+              f"{len(errors['not_s3'])} not in s3, {len(errors['error_scans'])} errors")
+    finally:
+        shutil.rmtree(out_dir)
@@ -0,0 +1,77 @@
+"""
+This script checks the "indexed" rendering engine (wsrdata.render_engine.render_indexed) against radar2mat.
+It renders sample scans with both engines using the render configs of an ARRAY_VERSION recorded in
+static/arrays/previous_versions.json, and prints for each member and field the fraction of mismatched pixels,
+i.e. pixels valid in one rendering and NaN in the other or differing by more than --tolerance, the max absolute
+and relative differences of pixels valid in both, the dtypes of both renderings, and the rendering time of each
+engine. Use it on real scans before switching RENDER_ENGINE of a version to "indexed", and record its output.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import numpy as np
+from wsrlib import pyart, radar2mat
+from wsrdata.derive_arrays import DERIVED_MEMBERS
+from wsrdata.render_engine import render_indexed
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--scan_dir", type=str, default="../static/scans/scans", help="directory of .gz scans")
+parser.add_argument("--previous_versions", type=str, default="../static/arrays/previous_versions.json",
+                    help="json of the render configs of versions")
+parser.add_argument("--array_version", type=str, default="v0.2.0", help="version whose configs are rendered")
+parser.add_argument("--num_scans", type=int, default=20, help="number of scans to sample")
+parser.add_argument("--tolerance", type=float, default=1e-4, help="absolute difference of matching pixels")
+args = parser.parse_args()
+
+with open(args.previous_versions, "r") as f:
+    configs = {DERIVED_MEMBERS[name]: config for name, config in json.load(f)[args.array_version].items()
+               if config is not None}
+scan_paths = sorted(os.path.join(dirpath, f) for dirpath, _, files in os.walk(args.scan_dir)
+                    for f in files if f.endswith(".gz"))
+random.Random(0).shuffle(scan_paths)
+
+mismatched, valid, max_diff, max_rel_diff, dtypes = {}, {}, {}, {}, {} # by (member, field)
+seconds = {"radar2mat": 0.0, "indexed": 0.0}
+failures = {"radar2mat": 0, "indexed": 0, "only one engine": 0}
+for scan_path in scan_paths[:args.num_scans]:
+    radar = pyart.io.read_nexrad_archive(scan_path)
+    for member, config in configs.items():
+        rendered = {}
+        for engine, render in [("radar2mat", radar2mat), ("indexed", render_indexed)]:
+            start = time.time()
+            try:
+                rendered[engine] = render(radar, **config)[0]
+            except Exception as ex:
+                print(f"{os.path.basename(scan_path)} {member}: {engine} failed - {ex}")
+                failures[engine] += 1
+            seconds[engine] += time.time() - start
+        if len(rendered) == 1:
+            failures["only one engine"] += 1
+        if len(rendered) < 2:
+            continue
+        reference, indexed = rendered["radar2mat"], rendered["indexed"]
+        for i, field in enumerate(config["fields"]):
+            key = (member, field)
+            a, b = np.asarray(reference[i], dtype=np.float64), np.asarray(indexed[i], dtype=np.float64)
+            both = ~np.isnan(a) & ~np.isnan(b)
+            differ = (np.isnan(a) != np.isnan(b)) | (both & (np.abs(np.where(both, a - b, 0.)) > args.tolerance))
+            mismatched[key] = mismatched.get(key, 0) + int(np.count_nonzero(differ))
+            valid[key] = valid.get(key, 0) + a.size
+            diff = np.abs(a - b)[both]
+            max_diff[key] = max(max_diff.get(key, 0.), float(diff.max(initial=0.)))
+            with np.errstate(divide="ignore", invalid="ignore"): # relative to radar2mat, infinite where it is 0
+                rel_diff = np.where(diff > 0, diff / np.abs(a[both]), 0.)
+            max_rel_diff[key] = max(max_rel_diff.get(key, 0.), float(rel_diff.max(initial=0.)))
+            dtypes[key] = (str(reference.dtype), str(indexed.dtype))
+
+for (member, field), count in mismatched.items():
+    reference_dtype, indexed_dtype = dtypes[(member, field)]
+    print(f"{member} {field}: {count / valid[(member, field)]:.4%} of pixels mismatched, "
+          f"max difference {max_diff[(member, field)]:.4g} (relative {max_rel_diff[(member, field)]:.4g}), "
+          f"dtype radar2mat {reference_dtype} indexed {indexed_dtype}"
+          + ("" if reference_dtype == indexed_dtype else " (DIFFERENT)"))
+print(f"radar2mat {seconds['radar2mat']:.1f} seconds, indexed {seconds['indexed']:.1f} seconds; failures: " +
+      ", ".join(f"{n} {engine}" for engine, n in failures.items()))
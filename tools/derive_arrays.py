@@ -0,0 +1,139 @@
+"""
+This script creates a new ARRAY_VERSION from the arrays of an existing version without rendering scans again,
+when the new render configs are subsets or crops of the existing ones, e.g. fewer fields or elevations,
+a smaller r_max or a lower dim (see wsrdata.derive_arrays).
+
+--target_config is a json file with the render configs of the new version in the format of
+static/arrays/previous_versions.json, i.e. {"array": ARRAY_RENDER_CONFIG, "dualpol": DUALPOL_RENDER_CONFIG}.
+The source version is the first version recorded in previous_versions.json from which both configs can be
+derived exactly, unless --source_version is given; with --pool, grids that are not crops at a stride of a
+source grid may be derived approximately by pooling blocks of pixels, and with --approximate, grids that are not
+aligned with a source grid at all, e.g. 300 or 150 px from the 600 px grid of v0.2.0, by nearest source pixels
+or by pooling runs of source pixels with --pool, up to the offsets in source pixels printed for each config.
+--check only prints how the target configs would be derived, e.g.
+    python derive_arrays.py --target_version v0.2.0-300 --target_config v0.2.0-300.json --approximate --check
+Files of the source version, npz files
+or shards, are derived in parallel into ARRAYS_DIR/TARGET_VERSION with the same layout, the new version is
+recorded in previous_versions.json, and how it was derived in TARGET_VERSION/derivation.json.
+Scans whose arrays fail to derive are listed in TARGET_VERSION/derivation_error_scans.log.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from functools import partial
+from wsrdata import array_shards
+from wsrdata.derive_arrays import derivation, find_source_version, derive_file
+from wsrdata.utils.profiling import ThroughputLog
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--arrays_dir", type=str, default="../static/arrays", help="directory of array versions")
+parser.add_argument("--target_version", type=str, required=True, help="new ARRAY_VERSION")
+parser.add_argument("--target_config", type=str, required=True, help="json file of the render configs")
+parser.add_argument("--source_version", type=str, default=None, help="version to derive from, default detected")
+parser.add_argument("--pool", type=str, default=None, choices=["mean", "max"],
+                    help="allow approximate derivations pooling blocks of pixels with this method")
+parser.add_argument("--approximate", action="store_true",
+                    help="allow grids that are not aligned with the source grid, see wsrdata.derive_arrays")
+parser.add_argument("--check", action="store_true", help="only print how the target configs would be derived")
+parser.add_argument("--array_codec", type=str, default=None, help="codec of derived files, default the source's")
+parser.add_argument("--num_workers", type=int, default=8, help="number of processes deriving files")
+parser.add_argument("--indent", type=int, default=None, help="indentation of previous_versions.json")
+args = parser.parse_args()
+
+
+def derive(paths, plans, target_configs, array_codec):
+    source_path, target_path = paths
+    try:
+        return source_path, derive_file(source_path, target_path, plans, target_configs, array_codec), None
+    except Exception as ex:
+        return source_path, [], str(ex)
+
+
+if __name__ == "__main__":
+    previous_versions_path = os.path.join(args.arrays_dir, "previous_versions.json")
+    with open(previous_versions_path, "r") as f:
+        previous_versions = json.load(f)
+    with open(args.target_config, "r") as f:
+        target_configs = json.load(f)
+
+    # check for conflicts and find how to derive the target configs
+    if args.target_version in previous_versions:
+        assert previous_versions[args.target_version] == target_configs, \
+            f"{args.target_version} is already recorded with other configs"
+    if args.source_version is not None:
+        plans = {name: derivation(previous_versions[args.source_version][name], config, args.pool, args.approximate)
+                 for name, config in target_configs.items()}
+        source_version = args.source_version if all(plan is not None for plan in plans.values()) else None
+    else:
+        source_version, plans = find_source_version(
+            {v: c for v, c in previous_versions.items() if v != args.target_version}, target_configs, args.pool,
+            args.approximate)
+    if source_version is None:
+        raise SystemExit("the target configs cannot be derived from " +
+                         (args.source_version or "any recorded version") + "; render them instead")
+    for name, plan in plans.items():
+        grid = f"start {plan['start']}, block {plan['block']}" if "start" in plan else "grids not aligned"
+        print(f"{name}: derived from {source_version} by {plan['method']} ({grid}, offset up to {plan['offset']} "
+              f"source pixels, fields {plan['fields']}, elevs {plan['elevs']})")
+    if args.check:
+        raise SystemExit
+
+    # list the array files of the source version, and scans of shards as "<shard>#<key>"
+    source_dir = os.path.join(args.arrays_dir, source_version)
+    target_dir = os.path.join(args.arrays_dir, args.target_version)
+    paths = []
+    for dirpath, _, files in os.walk(source_dir):
+        for f in sorted(files):
+            path = os.path.join(dirpath, f)
+            rel = os.path.relpath(path, source_dir)
+            if f.endswith(".npz"):
+                paths.append((path, os.path.join(target_dir, rel)))
+            elif f.endswith(".shard"):
+                for key in array_shards.read_index(path):
+                    paths.append((path + array_shards.SEPARATOR + key,
+                                  os.path.join(target_dir, rel) + array_shards.SEPARATOR + key))
+
+    # record the target version before writing it, as the prepare scripts do
+    previous_versions[args.target_version] = target_configs
+    with open(previous_versions_path, "w") as f:
+        json.dump(previous_versions, f, indent=args.indent)
+    os.makedirs(target_dir, exist_ok=True)
+    for f in os.listdir(source_dir): # scans that failed rendering also lack the derived members
+        if f.endswith("_error_scans.log"):
+            shutil.copyfile(os.path.join(source_dir, f), os.path.join(target_dir, f))
+
+    start = time.time()
+    progress = ThroughputLog(None, len(paths), "Derived")
+    counts = {} # member -> number of files with the member derived
+    failures = []
+    with multiprocessing.Pool(args.num_workers) as pool:
+        for source_path, members, error in pool.imap_unordered(
+                partial(derive, plans=plans, target_configs=target_configs, array_codec=args.array_codec),
+                paths, chunksize=16):
+            progress.record({})
+            for member in members:
+                counts[member] = counts.get(member, 0) + 1
+            if error is not None:
+                print(f"Failed to derive {source_path} - {error}")
+                failures.append(os.path.relpath(source_path, source_dir))
+    if failures:
+        with open(os.path.join(target_dir, "derivation_error_scans.log"), "a+") as f:
+            f.write("\n".join(failures) + "\n")
+
+    with open(os.path.join(target_dir, "derivation.json"), "w") as f:
+        json.dump({
+            "source_version":   source_version,
+            "plans":            plans,
+            "array_codec":      args.array_codec,
+            "files":            len(paths),
+            "members":          counts,
+            "failures":         len(failures),
+            "seconds":          round(time.time() - start, 1),
+            "time":             time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, f, indent=4)
+    print(f"Derived {len(paths) - len(failures)} of {len(paths)} files of {source_version} "
+          f"into {target_dir} in {time.time() - start:.0f} seconds")
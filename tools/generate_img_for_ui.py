@@ -1,7 +1,7 @@
 import os
-import numpy as np
 import json
 from wsrlib import pyart
+from wsrdata.array_store import load_level
 import matplotlib.pyplot as plt
 import matplotlib.colors as pltc
 from matplotlib import image
@@ -13,6 +13,7 @@ JSON_PATH = "../datasets/roosts_v0.1.0/roosts_v0.1.0.json"
 CHANNELS = {("reflectivity", 0.5): "/scratch2/wenlongzhao/roosts2021_ui_data/roosts_v0.1.0/ref0.5_images",
             ("velocity", 0.5): "/scratch2/wenlongzhao/roosts2021_ui_data/roosts_v0.1.0/rv0.5_images"}
 for channel in CHANNELS: os.makedirs(CHANNELS[channel], exist_ok=True)
+IMAGE_DIM = None # e.g. 300 to plot the smallest ARRAY_PYRAMID_DIMS level of at least 300 px, if arrays have one
 
 # visualization settings
 NORMALIZERS = {
@@ -41,7 +42,8 @@ for scan_list in SCAN_LIST_PATHS:
         if n % 1000 == 0:
             print(f"Processing the {n+1}th scan")
         scan = dataset["scans"][scan_to_id[SCAN]]
-        array = np.load(os.path.join(dataset["info"]["array_dir"], scan["array_path"]))["array"]
+        array = load_level(os.path.join(dataset["info"]["array_dir"], scan["array_path"]), "array", IMAGE_DIM,
+                           mmap=True) # only the planes plotted are read if arrays are uncompressed
 
         for channel in CHANNELS:
             attr = channel[0]
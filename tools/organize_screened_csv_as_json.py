@@ -5,12 +5,17 @@ It organizes scans and annotations from multiple years of a station and save the
 and calculates stats of ecologist-screened roost-system predictions.
 This script process one station at a run because
 loading npz files to calculate average dbz and checking dualpol can be slow.
+Scans in the statistics catalog of ARRAY_NPZ_DIR, written when rendering with SCAN_STATS including
+"mean_dbz" and "dualpol" (see wsrdata.scan_stats), are looked up there instead of loading their npz files.
 """
 
 import argparse
 import json
 import numpy as np
 import os
+from wsrdata.array_store import load_arrays, list_arrays, array_exists
+from wsrdata.render_npy_arrays import scan_to_array_path
+from wsrdata.scan_stats import read_catalog
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--station", type=str, required=True, help="station name")
@@ -25,6 +30,7 @@ SYS_END_DATE = '1231'
 ARRAY_NPZ_DIR = '/scratch2/wenlongzhao/RadarNPZ/v0.2.0'
     # npz files to store rendered arrays
     # eg. 2020/06/01/KAPX/KAPX20200601_092853_V06.npz
+ARRAY_LAYOUT = 'npz' # layout of ARRAY_NPZ_DIR, "npz" or a shard layout such as "shard-day" (see render_npy_arrays)
 SCREENED_ANNOTATION_CSV_DIR = '../static/annotations/v2.0.0/csv'
     # csv files output from the UI
     # eg. roost_labels_KAPX_20200601_20201231.csv
@@ -48,6 +54,14 @@ for file in sorted(os.listdir(SCREENED_ANNOTATION_CSV_DIR)):
         'n_scans_in_non_roost_days':            0,  # scans from sampled non_roost_days become negatives
         'non_roost_days':                       set(),  # days without roosts
     }
+# Per-scan statistics computed at render time, if any
+try:
+    catalog = read_catalog(ARRAY_NPZ_DIR, ['mean_dbz', 'dualpol'])
+    computed = ~np.isnan(catalog['dualpol'].astype(float)) # NaN for rows of jobs without these statistics
+    catalog_rows = {scan: i for i, scan in enumerate(catalog['scan']) if computed[i]}
+except KeyError: # no catalog, or one without these statistics
+    catalog_rows = {}
+print(f'{len(catalog_rows)} scans have statistics in the catalog of {ARRAY_NPZ_DIR}.')
 print(f'There are {len(station_years)} years for station {args.station} from the csv files that we\'re interested in.')
 print(f'Sample station-years: {list(station_years.keys())[:5]}.\n')
 
@@ -62,13 +76,19 @@ for station_year in station_years:
         scan = scan.strip().split(",")[0]
         if int(scan[8:10]) < MONTHS[0] or int(scan[8:10]) > MONTHS[1]:
             continue
-        npz_path = os.path.join(ARRAY_NPZ_DIR, f'{scan[4:8]}/{scan[8:10]}/{scan[10:12]}/{scan[:4]}/{scan}.npz')
-        assert os.path.exists(npz_path), f'{scan} does not have an npz'
-        arrays = np.load(npz_path)
-        station_years[station_year]['all_scans_with_check'][scan] = {
-            'avg_dbz':  np.mean(np.nan_to_num(arrays['array'][0, 0, :, :], copy=False, nan=0.0)),
-            'dualpol':  'dualpol_array' in arrays,
-        }
+        if scan in catalog_rows:
+            station_years[station_year]['all_scans_with_check'][scan] = {
+                'avg_dbz':  float(catalog['mean_dbz'][catalog_rows[scan], 0]), # lowest elevation
+                'dualpol':  bool(catalog['dualpol'][catalog_rows[scan]]),
+            }
+        else:
+            npz_path = os.path.join(ARRAY_NPZ_DIR, scan_to_array_path(scan, ARRAY_LAYOUT))
+            assert array_exists(npz_path), f'{scan} does not have an npz' # tools/validate_arrays.py checks all at once
+            array = load_arrays(npz_path, ['array'], mmap=True)['array'] # reads one plane if uncompressed
+            station_years[station_year]['all_scans_with_check'][scan] = {
+                'avg_dbz':  float(np.mean(np.nan_to_num(array[0, 0, :, :], nan=0.0))),
+                'dualpol':  'dualpol_array' in list_arrays(npz_path),
+            }
         if scan[4:12] not in station_years[station_year]['all_days_to_scans']:
             station_years[station_year]['all_days_to_scans'][scan[4:12]] = set()
         assert scan not in station_years[station_year]['all_days_to_scans'][scan[4:12]]
@@ -23,12 +23,14 @@ Solution: change ARRAY_VERSION or clean ../static/arrays including previous_vers
 """
 
 import os
+import glob
 import json
 import numpy as np
 import scipy.io as sio
 import wsrlib
 from wsrdata.download_radar_scans import download_by_scan_list
-from wsrdata.render_npy_arrays import render_by_scan_list
+from wsrdata.render_npy_arrays import IOOverlap, render_by_scan_list, scan_to_array_path
+from wsrdata.download_and_render import download_and_render_by_scan_list
 from wsrdata.utils.bbox_utils import scale_XYWH_box
 
 ############### Step 1: define metadata ###############
@@ -67,6 +69,36 @@ OVERWRITE_SPLITS    = False # default False; whether to overwrite the previous j
 SKIP_DOWNLOADING    = True # default True; whether to skip all downloading
 SKIP_RENDERING      = True # default True; whether to skip all rendering
 FORCE_RENDERING     = False # default False; whether to rerender even if an array npz already exists
+INCREMENTAL_RENDERING = False # default False; whether to render missing or stale members of existing npz files
+RESUME_RENDERING    = False # default False; whether to skip scans in the render journal of an interrupted run
+ARRAY_CODEC         = "npz" # default "npz"; codec of array npz files,
+    # see wsrdata.array_store and benchmark_array_codecs.py
+    # "npy" stores arrays uncompressed so that loaders can memory-map them and read single channels
+ARRAY_LAYOUT        = "npz" # default "npz"; one npz per scan, or "shard-day"/"shard-month" to pack scans into shards
+DOWNLOAD_WORKERS    = 1 # default 1; number of scans downloaded concurrently, e.g. 16 to overlap S3 requests
+RENDER_WORKERS      = 1 # number of processes rendering scans in step 5, or in steps 4 and 5 with STREAM_RENDERING
+PREFETCH_SCANS      = 0 # default 0; with RENDER_WORKERS 1, e.g. 2 to read and gunzip scans ahead of rendering
+    # on a thread, which holds that many more scans in memory
+WRITE_BEHIND        = 0 # default 0; with RENDER_WORKERS 1, e.g. 2 to compress and save rendered scans on a thread
+    # while the next ones render, which holds the arrays of that many more scans in memory
+SCAN_TIMEOUT        = None # default None; seconds after which rendering a scan in step 5 is killed, e.g. 300
+SCAN_MEMORY_LIMIT_MB = None # default None; MB of memory after which rendering a scan in step 5 is killed
+QUARANTINE_FACTOR   = None # default None; e.g. 4 to retry killed scans once, one at a time, with 4x the limits
+RENDER_SCHEDULE     = "list" # default "list"; "cost" renders the largest scans first so that workers finish together,
+    # with costs learned from the timing logs of previous runs (see PROFILE_SCANS) if there are any
+RENDER_ENGINE       = "radar2mat" # default "radar2mat"; "indexed" renders with cached index maps
+    # (wsrdata.render_engine), experimental: compare it with radar2mat by compare_render_engines.py before using it
+SWEEP_CACHE_DIR     = None # default None; e.g. f"{DATASET_DIR}/sweep_cache" to cache decoded sweeps for rerendering,
+    # requires RENDER_ENGINE "indexed"
+SWEEP_CACHE_GB      = 50 # default 50; size of the sweep cache over which least recently used scans are removed
+STREAM_RENDERING    = False # default False; whether to render scans as they are downloaded in steps 4 and 5
+KEEP_SCANS          = True # default True; whether streamed scans are saved to SCAN_DIR or only kept in memory
+ARRAY_PYRAMID_DIMS  = [] # default []; e.g. [300, 150] to also save arrays downsampled to these sizes, for
+    # consumers that need fewer pixels; read with wsrdata.array_store.load_level
+SCAN_STATS          = [] # default []; e.g. ["mean_dbz", "nan_fraction", "velocity_coverage", "dualpol"], per-scan
+    # statistics computed at render time into a catalog in ARRAY_DIR, read with wsrdata.scan_stats.read_catalog
+PROFILE_SCANS       = False # default False; whether to log per-scan stage timings, bytes and peak memory to
+    # jsonl files in SCAN_LOG_DIR and ARRAY_DIR, and print rolling scans/sec and ETA
 
 SCAN_LIST_PATH      = os.path.join("../static/scan_lists", DATASET_VERSION, "scan_list.txt")
 SPLIT_PATHS         = {"train": os.path.join("../static/scan_lists", DATASET_VERSION, INPUT_SPLIT_VERSION, "train.txt"),
@@ -225,13 +257,29 @@ for pre_dataset_version, pre_dataset_json_paths in PRE_DATASET_VERSION.items():
 
 
 ############### Step 4: Download radar scans ###############
+if not SKIP_DOWNLOADING and not SKIP_RENDERING and STREAM_RENDERING:
+    print("Downloading scans and rendering arrays...")
+    download_errors, array_errors, dualpol_errors = download_and_render_by_scan_list(
+        SCAN_LIST_PATH, SCAN_DIR, ARRAY_DIR,
+        ARRAY_RENDER_CONFIG, DUALPOL_RENDER_CONFIG,
+        os.path.join(SCAN_LOG_DIR, f"{DATASET_VERSION}.log"),
+        os.path.join(SCAN_LOG_NOT_S3_DIR, f"{DATASET_VERSION}.log"),
+        os.path.join(SCAN_LOG_ERROR_SCANS_DIR, f"{DATASET_VERSION}.log"),
+        FORCE_RENDERING, download_workers=DOWNLOAD_WORKERS, render_workers=RENDER_WORKERS, keep_scans=KEEP_SCANS,
+        incremental=INCREMENTAL_RENDERING, array_codec=ARRAY_CODEC, array_layout=ARRAY_LAYOUT,
+        resume=RESUME_RENDERING, engine=RENDER_ENGINE, pyramid_dims=ARRAY_PYRAMID_DIMS, scan_stats=SCAN_STATS,
+        timing_path=os.path.join(ARRAY_DIR, f"timing_{DATASET_VERSION}.jsonl") if PROFILE_SCANS else None,
+    )
+    SKIP_DOWNLOADING = SKIP_RENDERING = True # done in one pass
 if not SKIP_DOWNLOADING:
     print("Downloading scans...")
     download_errors = download_by_scan_list(
         SCAN_LIST_PATH, SCAN_DIR,
         os.path.join(SCAN_LOG_DIR, f"{DATASET_VERSION}.log"),
         os.path.join(SCAN_LOG_NOT_S3_DIR, f"{DATASET_VERSION}.log"),
-        os.path.join(SCAN_LOG_ERROR_SCANS_DIR, f"{DATASET_VERSION}.log")
+        os.path.join(SCAN_LOG_ERROR_SCANS_DIR, f"{DATASET_VERSION}.log"),
+        max_workers=DOWNLOAD_WORKERS,
+        timing_path=os.path.join(SCAN_LOG_DIR, f"timing_{DATASET_VERSION}.jsonl") if PROFILE_SCANS else None,
     )
 
 
@@ -240,7 +288,15 @@ if not SKIP_RENDERING:
     print("Rendering arrays...")
     array_errors, dualpol_errors = render_by_scan_list(
         SCAN_LIST_PATH, SCAN_DIR, ARRAY_DIR,
-        ARRAY_RENDER_CONFIG, DUALPOL_RENDER_CONFIG, FORCE_RENDERING
+        ARRAY_RENDER_CONFIG, DUALPOL_RENDER_CONFIG, FORCE_RENDERING,
+        num_workers=RENDER_WORKERS, incremental=INCREMENTAL_RENDERING,
+        array_codec=ARRAY_CODEC, array_layout=ARRAY_LAYOUT, resume=RESUME_RENDERING,
+        timing_path=os.path.join(ARRAY_DIR, f"timing_{DATASET_VERSION}.jsonl") if PROFILE_SCANS else None,
+        scan_timeout=SCAN_TIMEOUT, memory_limit_mb=SCAN_MEMORY_LIMIT_MB, quarantine_factor=QUARANTINE_FACTOR,
+        schedule=RENDER_SCHEDULE, cost_timing_paths=glob.glob(os.path.join(ARRAY_DIR, "timing_*.jsonl")),
+        engine=RENDER_ENGINE, sweep_cache_dir=SWEEP_CACHE_DIR, sweep_cache_gb=SWEEP_CACHE_GB,
+        overlap=IOOverlap(prefetch_scans=PREFETCH_SCANS, write_behind=WRITE_BEHIND),
+        pyramid_dims=ARRAY_PYRAMID_DIMS, scan_stats=SCAN_STATS,
     )
 
 
@@ -375,7 +431,7 @@ if not os.path.exists(f"{DATASET_DIR}/roosts_{DATASET_VERSION}.json") or OVERWRI
             "dataset_version":      DATASET_VERSION,
             "key":                  key,
             "minutes_from_sunrise": minutes_from_sunrise_dict[key] if key in minutes_from_sunrise_dict else None,
-            "array_path":           f"{key[4:8]}/{key[8:10]}/{key[10:12]}/{key[0:4]}/{key}.npz",
+            "array_path":           scan_to_array_path(key, ARRAY_LAYOUT),
         })
 
         if key in annotation_dict:
@@ -0,0 +1,106 @@
+"""
+This script validates the array files of an ARRAY_VERSION, npz files or shards, in parallel, reading only
+their zip directories and .npy headers (see wsrdata.validate_arrays), so that truncated files, missing members,
+and members of unexpected shapes or dtypes are found without decompressing any array.
+
+Expected members and shapes are those of the render configs of the version in previous_versions.json next to
+the version directory, i.e. ../static/arrays/previous_versions.json for ../static/arrays/v0.2.0.
+Members that are missing for scans listed in the error logs of the version, e.g. dualpol_array for scans in
+dualpol_error_scans.log (see wsrdata.render_npy_arrays.error_log_name), or any member for scans in
+killed_scans.log or derivation_error_scans.log, are expected to be missing and not reported.
+Problems are written to ARRAY_DIR/validation.log as "<array path> <kind> <message>" lines, and counts of
+problems by kind and of member dtypes to ARRAY_DIR/validation.json.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from functools import partial
+from wsrdata import array_shards
+from wsrdata.render_journal import KILLED_LOG_NAME
+from wsrdata.render_npy_arrays import error_log_name
+from wsrdata.validate_arrays import member_shapes, list_array_paths, path_to_scan, check_file
+from wsrdata.utils.profiling import ThroughputLog
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--array_dir", type=str, required=True, help="directory of an array version")
+parser.add_argument("--previous_versions", type=str, default=None,
+                    help="json of the render configs of versions, default previous_versions.json next to array_dir")
+parser.add_argument("--dtype", type=str, default=None, help="expected dtype of the members, e.g. float32")
+parser.add_argument("--num_workers", type=int, default=16, help="number of processes reading headers")
+args = parser.parse_args()
+
+
+DERIVATION_LOG_NAME = "derivation_error_scans.log" # written by derive_arrays.py
+
+
+def read_excused(array_dir, members):
+    # scan -> members known to be missing: the member of each rendering error log, e.g. dualpol_array for
+    # dualpol_error_scans.log, and all members for killed scans and scans whose derivation failed
+    logs = {error_log_name(member): [member] for member in members}
+    logs[KILLED_LOG_NAME] = logs[DERIVATION_LOG_NAME] = list(members)
+    excused = {}
+    for f, log_members in logs.items():
+        if not os.path.exists(os.path.join(array_dir, f)):
+            continue
+        with open(os.path.join(array_dir, f), "r") as log:
+            for line in log:
+                if line.strip():
+                    scan = os.path.basename(line.split()[0]).rsplit(array_shards.SEPARATOR, 1)[-1]
+                    scan = scan[:-len(".npz")] if scan.endswith(".npz") else scan
+                    excused.setdefault(scan, set()).update(log_members)
+    return excused
+
+
+def check(path, shapes, dtype, excused):
+    headers, problems = check_file(path, shapes, dtype, excused.get(path_to_scan(path), ()))
+    return path, {name: member_dtype for name, (_, member_dtype) in headers.items()}, problems
+
+
+if __name__ == "__main__":
+    array_dir = os.path.normpath(args.array_dir)
+    version = os.path.basename(array_dir)
+    previous_versions_path = args.previous_versions or \
+        os.path.join(os.path.dirname(array_dir), "previous_versions.json")
+    with open(previous_versions_path, "r") as f:
+        previous_versions = json.load(f)
+    assert version in previous_versions, f"{version} is not recorded in {previous_versions_path}"
+    shapes = member_shapes(previous_versions[version])
+    for member, shape in shapes.items():
+        print(f"Expecting {member} of shape {shape}")
+
+    start = time.time()
+    paths = list_array_paths(array_dir)
+    print(f"Validating {len(paths)} array files listed in {time.time() - start:.0f} seconds")
+    excused = read_excused(array_dir, shapes)
+
+    progress = ThroughputLog(None, len(paths), "Validated")
+    counts = {} # kind -> number of problems
+    dtypes = {} # member -> dtype -> number of files
+    with multiprocessing.Pool(args.num_workers) as pool, \
+            open(os.path.join(array_dir, "validation.log"), "w") as log:
+        for path, member_dtypes, problems in pool.imap_unordered(
+                partial(check, shapes=shapes, dtype=args.dtype, excused=excused), paths, chunksize=64):
+            progress.record({})
+            for name, member_dtype in member_dtypes.items():
+                dtypes.setdefault(name, {})
+                dtypes[name][member_dtype] = dtypes[name].get(member_dtype, 0) + 1
+            for kind, message in problems:
+                counts[kind] = counts.get(kind, 0) + 1
+                log.write(f"{os.path.relpath(path, array_dir)} {kind} {message}\n")
+
+    with open(os.path.join(array_dir, "validation.json"), "w") as f:
+        json.dump({
+            "files":            len(paths),
+            "problems":         counts,
+            "dtypes":           dtypes,
+            "seconds":          round(time.time() - start, 1),
+            "time":             time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, f, indent=4)
+    for name, member_dtypes in sorted(dtypes.items()):
+        print(f"{name}: " + ", ".join(f"{n} files of {d}" for d, n in sorted(member_dtypes.items())))
+    print(f"Validated {len(paths)} files of {version} in {time.time() - start:.0f} seconds: " +
+          (", ".join(f"{n} {kind}" for kind, n in sorted(counts.items())) or "no problems") +
+          (f"; see {os.path.join(array_dir, 'validation.log')}" if counts else ""))
@@ -3,6 +3,7 @@ import numpy as np
 import json
 from wsrlib import pyart, radar2mat
 from wsrdata.utils.bbox_utils import scale_XYWH_box
+from wsrdata.array_store import load_arrays
 import matplotlib.pyplot as plt
 import matplotlib.colors as pltc
 OUTPUT_DIR = None # if not None, save all figures directly under this
@@ -59,7 +60,8 @@ for scan_list in SCAN_LIST_PATHS:
     for n, SCAN in enumerate(scans):
         print(f"Processing the {n+1}th scan")
         scan = dataset["scans"][scan_to_id[SCAN]]
-        array = np.load(os.path.join(dataset["info"]["array_dir"], scan["array_path"]))["array"]
+        array = load_arrays(os.path.join(dataset["info"]["array_dir"], scan["array_path"]), ["array"],
+                            mmap=True)["array"] # only the planes plotted are read if arrays are uncompressed
 
         fig, axs = plt.subplots(int(np.ceil(len(CHANNELS)/3)), 3,
                                 figsize=(21, 7*int(np.ceil(len(CHANNELS)/3))),